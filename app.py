@@ -2,10 +2,25 @@ import streamlit as st
 from pathlib import Path
 import pandas as pd
 
-from header_log import build_header_change_log_from_bytes
-from shams_parser import parse_all_sheets_from_bytes
-from compare import compare_shams, comparison_stats
+from baseline import Baseline, BaselineStore
+from header_log import extract_headers_from_main_table
+from shams_parser import PARSER_VERSION, parse_all_sheets_from_bytes, parse_workbook
+from compare import (
+    COMPARE_WORKERS,
+    DUPLICATE_POLICY,
+    SHARDED_MIN_ROWS,
+    CompareSession,
+    cached_comparison,
+    compare_sharded,
+    compare_identical,
+    compare_result_key,
+    normalize_compare_columns,
+)
 from DB import DB_COLUMNS
+from cache import sidecar_frame
+from snapshots import save_snapshot
+from workbook import read_sheet, sheet_fingerprints, workbook_key
+from utils import subclass_key_series, format_subclass_key_series
 import io
 
 
@@ -37,8 +52,9 @@ if not SHAMS_PATH.exists():
 # ================== SESSION STATE ==================
 def init_state():
     defaults = {
-        "shams_bytes": None,
+        "baseline": None,
         "shams2_bytes": None,
+        "shams2_name": None,
 
         "headers_old": None,
         "headers_new": None,
@@ -47,6 +63,7 @@ def init_state():
         "column_mapping": None,
 
         "df_compare": None,
+        "compare_key": None,
         "compare_stats": None,
 
         "db_column_mapping": None,
@@ -62,11 +79,87 @@ def init_state():
 init_state()
 
 
+# ================== BASELINE ==================
+# Один распарсенный базовый каталог на процесс (shams.xlsx или последний снимок):
+# строится в фоне при первом запуске сервера, сессии держат только ссылку на него.
+@st.cache_resource(show_spinner=False)
+def get_baseline_store() -> BaselineStore:
+    store = BaselineStore(SHAMS_PATH)
+    store.warm_up()
+    return store
+
+
+get_baseline_store()
+
+
 # ================== HELPERS ==================
 def load_shams():
-    if st.session_state.shams_bytes is None:
-        with open(SHAMS_PATH, "rb") as f:
-            st.session_state.shams_bytes = f.read()
+    """Закрепляет за сессией текущий базовый каталог (перечитывается, если файл изменился)."""
+    st.session_state.baseline = get_baseline_store().get()
+
+
+# ================== CACHE ==================
+# Streamlit перезапускает скрипт на каждый клик — тяжёлые шаги мемоизируем по хешу аргументов.
+# Байты файлов входят в ключ, поэтому новый файл = новая запись.
+CACHE_TTL = 60 * 60          # секунд
+CACHE_MAX_ENTRIES = 16
+
+
+@st.cache_data(ttl=CACHE_TTL, max_entries=CACHE_MAX_ENTRIES, show_spinner=False)
+def cached_headers(file_bytes: bytes):
+    return extract_headers_from_main_table(file_bytes)
+
+
+@st.cache_data(ttl=CACHE_TTL, max_entries=CACHE_MAX_ENTRIES, show_spinner=False)
+def cached_parse(file_bytes: bytes):
+    # листы, совпавшие с базовым файлом (по отпечатку содержимого), не парсим заново
+    baseline = get_baseline_store().get()
+    if baseline.same_content(file_bytes):
+        return baseline.frames
+    return parse_all_sheets_from_bytes(file_bytes, sheets=None, reuse=baseline.sheets)
+
+
+@st.cache_data(ttl=CACHE_TTL, max_entries=CACHE_MAX_ENTRIES, show_spinner=False)
+def cached_compare(_baseline: Baseline, compare_key: str, _new_bytes: bytes, column_mapping: dict):
+    # ключ — compare_key (хеши обоих файлов + сопоставление); результат ещё и на диске,
+    # поэтому повтор того же сравнения в другой сессии / после рестарта открывается сразу
+    def compute():
+        if _baseline.same_content(_new_bytes):
+            # провайдер прислал тот же файл — готовый результат "без изменений", без парсинга и merge
+            return compare_identical(_baseline.df_full, column_mapping)
+        df_full_new = cached_parse(_new_bytes)[0]
+        if COMPARE_WORKERS > 1 and len(_baseline.df_full) + len(df_full_new) >= SHARDED_MIN_ROWS:
+            # большие файлы — по Division в процессах; сессия (и её кэши между правками) не нужна
+            return compare_sharded(_baseline.df_full, df_full_new, column_mapping, workers=COMPARE_WORKERS)[0]
+        return compare_session(_baseline, _baseline.key, _new_bytes).result(column_mapping)
+
+    return cached_comparison(compare_key, compute)
+
+
+@st.cache_resource(max_entries=CACHE_MAX_ENTRIES, show_spinner=False)
+def compare_session(_baseline: Baseline, baseline_key: str, new_bytes: bytes) -> CompareSession:
+    # одна сессия на пару файлов: merge и diff по колонкам переживают правки сопоставления
+    df_full_new, *_ = cached_parse(new_bytes)
+    return CompareSession(_baseline.df_full, df_full_new, old_normalized=_baseline.normalized)
+
+
+def save_upload_snapshot(file_bytes: bytes, provider: str | None):
+    """
+    Снимок распарсенного нового файла — следующие сравнения берут его "старой" стороной.
+    Вызывается только по кнопке «Принять как базовый»; None — снимок записать не удалось.
+    """
+    # кадры и результаты по листам — из дискового кэша парсинга (файл уже разбирался при сравнении)
+    frames, results = parse_workbook(file_bytes, reuse=get_baseline_store().get().sheets)
+    key = workbook_key(file_bytes)
+    return save_snapshot(
+        key,
+        frames,
+        normalize_compare_columns(frames[0]),
+        cached_headers(file_bytes),
+        sheet_fingerprints(file_bytes, key),
+        provider=provider,
+        sheets={fp: r for fp, r in results if fp},
+    )
 
 
 # ================== UI ==================
@@ -88,12 +181,14 @@ if st.session_state.stage == STAGE_UPLOAD:
 
     if uploaded is not None:
         st.session_state.shams2_bytes = uploaded.read()
+        st.session_state.shams2_name = uploaded.name
 
     col1, col2 = st.columns(2)
 
     with col1:
         if st.button("Отменить"):
             st.session_state.shams2_bytes = None
+            st.session_state.shams2_name = None
 
     with col2:
         if st.button(
@@ -102,11 +197,12 @@ if st.session_state.stage == STAGE_UPLOAD:
         ):
             load_shams()
 
-            h_old, h_new, _ = build_header_change_log_from_bytes(
-                st.session_state.shams_bytes,
-                st.session_state.shams2_bytes,
-                sheets=None
-            )
+            baseline = st.session_state.baseline
+            h_old = baseline.headers
+            if baseline.same_content(st.session_state.shams2_bytes):
+                h_new = list(baseline.headers)
+            else:
+                h_new = cached_headers(st.session_state.shams2_bytes)
 
             st.session_state.headers_old = h_old
             st.session_state.headers_new = h_new
@@ -246,21 +342,26 @@ if st.session_state.stage == STAGE_COMPARE:
     st.subheader("Статистика сравнения")
 
     if st.session_state.df_compare is None:
-        df_full_old, *_ = parse_all_sheets_from_bytes(
-            st.session_state.shams_bytes, sheets=None
-        )
-        df_full_new, *_ = parse_all_sheets_from_bytes(
-            st.session_state.shams2_bytes, sheets=None
+        baseline = st.session_state.baseline
+
+        # ключ результата сравнения: базовый файл + новый файл + сопоставление
+        compare_key = compare_result_key(
+            baseline.key,
+            workbook_key(st.session_state.shams2_bytes),
+            st.session_state.column_mapping,
+            parser_version=PARSER_VERSION,
+            duplicates=DUPLICATE_POLICY,
         )
-
-        df_compare = compare_shams(
-            df_full_old,
-            df_full_new,
-            st.session_state.column_mapping
+        df_compare, stats_df = cached_compare(
+            baseline,
+            compare_key,
+            st.session_state.shams2_bytes,
+            st.session_state.column_mapping,
         )
 
+        st.session_state.compare_key = compare_key
         st.session_state.df_compare = df_compare
-        st.session_state.compare_stats = comparison_stats(df_compare)
+        st.session_state.compare_stats = stats_df
 
     stats_df = st.session_state.compare_stats
     stats = dict(zip(stats_df["metric"], stats_df["value"]))
@@ -274,7 +375,14 @@ if st.session_state.stage == STAGE_COMPARE:
     **Остались без изменений:** {stats['Не изменено']}  
     """)
 
-    col1, col2 = st.columns(2)
+    # повторяющиеся Subclass_code: в сравнении оставлена одна строка на код (compare.DUPLICATE_POLICY)
+    dups = st.session_state.df_compare.attrs.get("duplicates")
+    if dups is not None and len(dups):
+        st.warning(f"Повторяющиеся коды активити: {dups['Subclass_code'].nunique()} — в сравнении оставлена одна строка на код")
+        with st.expander("Повторяющиеся коды"):
+            st.dataframe(dups)
+
+    col1, col2, col3 = st.columns(3)
 
     with col1:
         if st.button("Назад"):
@@ -282,6 +390,17 @@ if st.session_state.stage == STAGE_COMPARE:
             st.rerun()
 
     with col2:
+        # новый файл становится базовым (снимком) для следующих загрузок — только по явному решению
+        if st.button(
+            "Принять как базовый",
+            disabled=st.session_state.baseline.same_content(st.session_state.shams2_bytes),
+        ):
+            if save_upload_snapshot(st.session_state.shams2_bytes, st.session_state.shams2_name) is not None:
+                st.success("Файл принят как базовый: следующие загрузки сравниваются с ним")
+            else:
+                st.error("Не удалось сохранить снимок файла")
+
+    with col3:
         if st.button("Актуализировать в БД", type="primary"):
             st.session_state.stage = STAGE_DB_MAPPING
             st.rerun()
@@ -418,7 +537,8 @@ def _build_export_df(df_compare: pd.DataFrame, db_df: pd.DataFrame, db_map: dict
     # (если у тебя Subclass уже есть в df_compare — отлично, просто выведем его рядом)
     # если Subclass хранится только в db_df — тоже выведем.
     # Итог: в "front" попадёт то, что реально существует после merge.
-    merged = df_compare.merge(
+    # join по int-ключу (subclass_key): в df_compare код — строка NNNN.NN, в db_df — уже int
+    merged = df_compare.assign(Subclass_code=subclass_key_series(df_compare["Subclass_code"])).merge(
         db_df,
         on="Subclass_code",
         how="left",
@@ -478,7 +598,11 @@ def _build_export_df(df_compare: pd.DataFrame, db_df: pd.DataFrame, db_map: dict
     # финальная защита: только существующие
     export_cols = [c for c in export_cols if c in merged.columns]
 
-    return merged[export_cols]
+    # ключ хранится как int — в файл выгружаем в привычном виде NNNN.NN
+    out = merged[export_cols]
+    if "Subclass_code" in out.columns:
+        out = out.assign(Subclass_code=format_subclass_key_series(out["Subclass_code"]))
+    return out
 
 
 
@@ -489,34 +613,67 @@ def _to_excel_bytes(df: pd.DataFrame, sheet_name: str = "export") -> bytes:
     buf.seek(0)
     return buf.getvalue()
 
-import re
 
-def _normalize_code(val):
-    if pd.isna(val):
-        return None
-    s = re.sub(r"[^0-9]", "", str(val))
-    if len(s) < 5:
-        return None
-    return f"{s[:4]}.{s[4:].ljust(2,'0')[:2]}"
+# Версия load_db_df — входит в ключ файла-спутника; увеличить при изменении результата
+DB_CACHE_VERSION = 1
+
+
+@st.cache_resource(max_entries=2, show_spinner=False)
+def _load_db_df_cached(db_mtime: float) -> pd.DataFrame:
+    # один кадр на процесс (только чтение — _build_export_df работает с копией);
+    # xlsx декодируется, только если спутник устарел
+    return sidecar_frame(DB_PATH, load_db_df, version=DB_CACHE_VERSION)
+
+
+def get_db_df() -> pd.DataFrame:
+    """load_db_df с кэшем: перечитываем файл БД только если изменился его mtime."""
+    return _load_db_df_cached(DB_PATH.stat().st_mtime)
+
+
+@st.cache_data(ttl=CACHE_TTL, max_entries=CACHE_MAX_ENTRIES, show_spinner=False)
+def cached_export_xlsx(_df_compare, compare_key: str, db_map: dict, db_mtime: float, _new_bytes: bytes) -> bytes:
+    """
+    Многолистный Excel для выгрузки. Ключ — compare_key (входы сравнения),
+    сопоставление с БД и mtime файла БД; сам df_compare и байты shams2 не хешируются.
+    """
+    # 1) экспортный df (рядом: столбец результата + столбец из БД)
+    export_df = _build_export_df(_df_compare, get_db_df(), db_map)
+
+    # 2) уровни (Section/Division/Group/Class) из нового файла (shams2)
+    _, df_sections, df_divisions, df_groups, df_classes, _ = cached_parse(_new_bytes)
+
+    # 3) пишем многолистный Excel
+    buf = io.BytesIO()
+    with pd.ExcelWriter(buf, engine="openpyxl") as writer:
+        export_df.to_excel(writer, index=False, sheet_name="for_review")
+
+        # уровни отдельными листами
+        df_sections.to_excel(writer, index=False, sheet_name="sections")
+        df_divisions.to_excel(writer, index=False, sheet_name="divisions")
+        df_groups.to_excel(writer, index=False, sheet_name="groups")
+        df_classes.to_excel(writer, index=False, sheet_name="classes")
+
+    buf.seek(0)
+    return buf.getvalue()
 
 
 def load_db_df() -> pd.DataFrame:
-    """Читает shams_edit1.xlsx и гарантирует наличие Subclass_code."""
-    df_db = pd.read_excel(DB_PATH)
+    """Читает shams_edit1.xlsx и гарантирует наличие Subclass_code (int-ключ, см. subclass_key)."""
+    df_db = read_sheet(DB_PATH, header=0)
 
     # 1) если уже есть Subclass_code
     if "Subclass_code" in df_db.columns:
-        df_db["Subclass_code"] = df_db["Subclass_code"].apply(_normalize_code)
+        df_db["Subclass_code"] = subclass_key_series(df_db["Subclass_code"])
         return df_db
 
     # 2) стандартный столбец edit-файла
     if "Введите код бизнес-деятельности" in df_db.columns:
-        df_db["Subclass_code"] = df_db["Введите код бизнес-деятельности"].apply(_normalize_code)
+        df_db["Subclass_code"] = subclass_key_series(df_db["Введите код бизнес-деятельности"])
         return df_db
 
     # 3) fallback
     if "Subclass" in df_db.columns:
-        df_db["Subclass_code"] = df_db["Subclass"].apply(_normalize_code)
+        df_db["Subclass_code"] = subclass_key_series(df_db["Subclass"])
         return df_db
 
     raise ValueError(
@@ -632,36 +789,27 @@ if st.session_state.stage == STAGE_DB_EXPORT:
     db_map = st.session_state.db_column_mapping or {}
 
     # 1) Загружаем таблицу "БД" (shams_edit1.xlsx)
-    db_df = load_db_df()
+    db_df = get_db_df()
     if db_df is None or db_df.empty:
         st.error("Файл БД пустой или не загрузился.")
         st.stop()
 
-    # 2) Собираем экспортный df (рядом: столбец результата + столбец из БД)
-    export_df = _build_export_df(df_compare, db_df, db_map)
-
-    # 3) Парсим уровни (Section/Division/Group/Class) из нового файла (shams2)
+    # 2) Проверяем, что уровни (Section/Division/Group/Class) из нового файла (shams2) парсятся
     try:
-        _, df_sections, df_divisions, df_groups, df_classes, _ = parse_all_sheets_from_bytes(
-            st.session_state.shams2_bytes, sheets=None
-        )
+        cached_parse(st.session_state.shams2_bytes)
     except Exception as e:
         st.error(f"Не удалось распарсить уровни из shams2: {e}")
         st.stop()
 
-    # 4) Пишем многолистный Excel
-    buf = io.BytesIO()
-    with pd.ExcelWriter(buf, engine="openpyxl") as writer:
-        export_df.to_excel(writer, index=False, sheet_name="for_review")
-
-        # уровни отдельными листами
-        df_sections.to_excel(writer, index=False, sheet_name="sections")
-        df_divisions.to_excel(writer, index=False, sheet_name="divisions")
-        df_groups.to_excel(writer, index=False, sheet_name="groups")
-        df_classes.to_excel(writer, index=False, sheet_name="classes")
-
-    buf.seek(0)
-    xlsx_bytes = buf.getvalue()
+    # 3) Готовый Excel берём из кэша: пересобираем, только если изменились
+    #    результат сравнения, сопоставление с БД или файл БД
+    xlsx_bytes = cached_export_xlsx(
+        df_compare,
+        st.session_state.compare_key,
+        db_map,
+        DB_PATH.stat().st_mtime,
+        st.session_state.shams2_bytes,
+    )
 
     st.download_button(
         label="Скачать в excel",
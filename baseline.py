@@ -0,0 +1,136 @@
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+
+import pandas as pd
+
+from compare import normalize_compare_columns
+from header_log import extract_headers_from_main_table
+from shams_parser import parse_workbook
+from snapshots import Snapshot, latest_snapshot
+from workbook import sheet_fingerprints, workbook_key
+
+
+@dataclass(frozen=True)
+class Baseline:
+    """
+    Распарсенный базовый каталог (shams.xlsx).
+
+    Один объект на процесс, все сессии держат ссылку на него —
+    кадры и списки только для чтения, менять их на месте нельзя.
+    """
+
+    path: Path  # shams.xlsx или каталог снимка
+    mtime: float  # mtime файла / время создания снимка
+    key: str  # SHA-256 исходного xlsx
+    headers: list
+    frames: tuple  # (df_full, df_sections, df_divisions, df_groups, df_classes, df_subclasses)
+    fingerprints: dict  # {лист: отпечаток содержимого} — workbook.sheet_fingerprints
+    sheets: dict  # {отпечаток листа: результат parse_sheet} — reuse для parse_all_sheets_from_bytes
+    normalized: pd.DataFrame  # normalize_compare_columns(df_full) — old_normalized для CompareSession
+
+    @property
+    def df_full(self) -> pd.DataFrame:
+        return self.frames[0]
+
+    def same_content(self, file_bytes: bytes) -> bool:
+        """
+        Файл совпадает с базовым: те же байты или те же листы (имена, порядок и отпечатки).
+        Второе ловит пересохранённый без изменений файл, у которого поменялась только упаковка zip.
+        """
+        key = workbook_key(file_bytes)
+        if key == self.key:
+            return True
+        fingerprints = sheet_fingerprints(file_bytes, key)
+        return bool(fingerprints) and list(fingerprints.items()) == list(self.fingerprints.items())
+
+
+def load_baseline(path: Path) -> Baseline:
+    path = Path(path)
+    mtime = path.stat().st_mtime
+    file_bytes = path.read_bytes()
+    key = workbook_key(file_bytes)
+    # через дисковый кэш парсинга: повторный запуск не декодирует базовый файл
+    frames, results = parse_workbook(file_bytes)
+
+    return Baseline(
+        path=path,
+        mtime=mtime,
+        key=key,
+        headers=extract_headers_from_main_table(file_bytes),
+        frames=frames,
+        fingerprints=sheet_fingerprints(file_bytes, key),
+        sheets={fp: r for fp, r in results if fp},
+        normalized=normalize_compare_columns(frames[0]),
+    )
+
+
+def load_snapshot(snapshot: Snapshot) -> Baseline:
+    """Baseline из снимка: читаются готовые кадры, xlsx не открывается."""
+    return Baseline(
+        path=snapshot.path,
+        mtime=snapshot.created,
+        key=snapshot.source_hash,
+        headers=snapshot.meta["headers"],
+        frames=snapshot.frames(),
+        fingerprints=snapshot.meta["fingerprints"],
+        sheets=snapshot.sheets(),
+        normalized=snapshot.normalized(),
+    )
+
+
+class BaselineStore:
+    """
+    Хранилище базового каталога на процесс.
+
+    Базовый каталог — самый свежий из двух источников: shams.xlsx (по mtime)
+    и последний снимок (snapshots.latest_snapshot, по времени создания).
+    warm_up() строит Baseline в фоновом потоке (при старте сервера);
+    get() ждёт первую загрузку и перечитывает источник, если он сменился.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._current = None
+        self._error = None
+        self._ready = threading.Event()
+        self._lock = threading.Lock()
+
+    def warm_up(self):
+        threading.Thread(target=self._load, name="baseline-warm-up", daemon=True).start()
+
+    def _source(self):
+        """(путь, mtime, снимок|None) самого свежего источника."""
+        mtime = self.path.stat().st_mtime
+        snapshot = latest_snapshot()
+        if snapshot is not None and snapshot.created > mtime:
+            return snapshot.path, snapshot.created, snapshot
+        return self.path, mtime, None
+
+    def _is_current(self, source) -> bool:
+        current = self._current
+        return current is not None and (current.path, current.mtime) == source[:2]
+
+    def _load(self):
+        with self._lock:
+            try:
+                source = self._source()
+                if not self._is_current(source):
+                    path, _, snapshot = source
+                    self._current = load_snapshot(snapshot) if snapshot is not None else load_baseline(path)
+                self._error = None
+            except Exception as e:  # отдадим ошибку в get(), поток падать не должен
+                self._error = e
+            finally:
+                self._ready.set()
+
+    def get(self) -> Baseline:
+        self._ready.wait()
+
+        if not self._is_current(self._source()):
+            self._load()
+
+        current = self._current
+        if current is None:
+            raise self._error
+        return current
@@ -0,0 +1,71 @@
+"""
+Замеры скорости чтения по движкам (workbook.ENGINES).
+
+Запуск:  python bench.py [файл.xlsx ...]
+По умолчанию меряет shams.xlsx и shams_edit1.xlsx.
+"""
+import sys
+import time
+from pathlib import Path
+
+import pandas as pd
+
+from workbook import ENGINES, WorkbookSession, engine_available, iter_sheet_rows, read_sheet
+
+BASE_DIR = Path(__file__).resolve().parent
+DEFAULT_FILES = [BASE_DIR / "shams.xlsx", BASE_DIR / "shams_edit1.xlsx"]
+REPEATS = 3
+
+
+def _best_of(fn) -> float:
+    best = None
+    for _ in range(REPEATS):
+        t0 = time.perf_counter()
+        fn()
+        dt = time.perf_counter() - t0
+        best = dt if best is None else min(best, dt)
+    return best
+
+
+def bench_file(path: Path) -> list:
+    file_bytes = path.read_bytes()
+    rows = []
+
+    for engine in ENGINES:
+        if not engine_available(engine):
+            rows.append({"file": path.name, "engine": engine, "task": "-", "seconds": None, "note": "не установлен"})
+            continue
+
+        if engine == "csv":
+            # CSV работает только с выгрузками на диске
+            try:
+                seconds = _best_of(lambda: read_sheet(path, 0, header=0, engine="csv", fallback=False))
+                rows.append({"file": path.name, "engine": engine, "task": "first sheet", "seconds": seconds, "note": ""})
+            except FileNotFoundError as e:
+                rows.append({"file": path.name, "engine": engine, "task": "-", "seconds": None, "note": str(e)})
+            continue
+
+        def all_sheets():
+            session = WorkbookSession(file_bytes, engine=engine)
+            for sheet in session.sheet_names:
+                session.sheet(sheet)
+
+        def header_rows():
+            for _, sheet_rows in iter_sheet_rows(file_bytes, engine=engine):
+                for _ in zip(range(50), sheet_rows):
+                    pass
+
+        rows.append({"file": path.name, "engine": engine, "task": "all sheets", "seconds": _best_of(all_sheets), "note": ""})
+        rows.append({"file": path.name, "engine": engine, "task": "first 50 rows", "seconds": _best_of(header_rows), "note": ""})
+
+    return rows
+
+
+def main(argv):
+    files = [Path(a) for a in argv] or DEFAULT_FILES
+    result = pd.DataFrame([r for f in files for r in bench_file(f)])
+    print(result.to_string(index=False))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
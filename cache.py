@@ -0,0 +1,332 @@
+import hashlib
+import importlib.util
+import json
+import logging
+import os
+import pickle
+import shutil
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+log = logging.getLogger(__name__)
+
+BASE_DIR = Path(__file__).resolve().parent
+CACHE_DIR = Path(os.environ.get("SHAMS_CACHE_DIR", BASE_DIR / ".cache"))
+
+# Parquet (pyarrow) — основной формат; pickle — только запасной (нет pyarrow / неподдержанные типы)
+HAS_PYARROW = importlib.util.find_spec("pyarrow") is not None
+
+
+def content_hash(*parts) -> str:
+    """SHA-256 от набора частей: bytes берутся как есть, остальное — через JSON."""
+    h = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, (bytes, bytearray)):
+            h.update(part)
+        else:
+            h.update(json.dumps(part, sort_keys=True, ensure_ascii=False, default=str).encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+def file_hash(path: Path) -> str:
+    """SHA-256 файла (читается блоками)."""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+# Смешанные object-колонки (числа и текст: 5, 5.0, "5a", NaN) пишутся в Parquet строками,
+# а тип каждого значения — в соседнюю колонку TYPE_PREFIX + имя; при чтении значения восстанавливаются.
+TYPE_PREFIX = "__type__"
+
+_DECODERS = {
+    "str": str,
+    "int": int,
+    "float": float,
+    "bool": lambda v: v == "True",
+    "nan": lambda v: np.nan,
+    "none": lambda v: None,
+}
+
+
+def _value_type(v):
+    """Тег типа значения для _DECODERS; None — тип не кодируется (кадр уйдёт в pickle)."""
+    if v is None:
+        return "none"
+    if isinstance(v, str):
+        return "str"
+    if isinstance(v, (bool, np.bool_)):
+        return "bool"
+    if isinstance(v, (int, np.integer)):
+        return "int"
+    if isinstance(v, (float, np.floating)):
+        return "nan" if v != v else "float"
+    return None
+
+
+def _encode_value(v, kind):
+    if kind in ("nan", "none"):
+        return None
+    if kind == "float":
+        return repr(float(v))
+    return str(v)
+
+
+def encode_mixed_columns(df: pd.DataFrame):
+    """
+    Кадр для Parquet: object-колонки, где кроме строк есть числа / NaN, → строки + колонка типов.
+    Возвращает None, если кодировать нельзя (другие типы значений, занятое имя колонки типов).
+    """
+    out = {}
+    for c in df.columns:
+        col = df[c]
+        out[c] = col
+        if col.dtype != object or not isinstance(c, str) or _column_kind(col) == "list":
+            continue
+        kinds = [_value_type(v) for v in col]
+        if set(kinds) <= {"str", "none"}:
+            continue
+        if None in kinds or TYPE_PREFIX + c in df.columns:
+            return None
+        out[c] = pd.Series([_encode_value(v, k) for v, k in zip(col, kinds)], index=col.index, dtype=object)
+        out[TYPE_PREFIX + c] = pd.Series(kinds, index=col.index, dtype=object)
+    return pd.DataFrame(out, index=df.index) if len(out) > len(df.columns) else df
+
+
+def decode_mixed_columns(df: pd.DataFrame) -> pd.DataFrame:
+    """Обратное к encode_mixed_columns: значения возвращают исходный тип, колонки типов убираются."""
+    type_cols = [c for c in df.columns if isinstance(c, str) and c.startswith(TYPE_PREFIX)]
+    for t in type_cols:
+        c = t[len(TYPE_PREFIX):]
+        df[c] = pd.Series(
+            [_DECODERS[k](v) for v, k in zip(df[c], df[t])], index=df.index, dtype=object
+        )
+    return df.drop(columns=type_cols)
+
+
+def _column_kind(col: pd.Series) -> str:
+    """"string" / "empty" / "list" (списки строк) / "mixed" — для object-колонки."""
+    kind = pd.api.types.infer_dtype(col, skipna=True)
+    if kind in ("string", "empty"):
+        return kind
+    values = col.dropna()
+    if len(values) and all(isinstance(v, list) for v in values):
+        if all(isinstance(x, str) for v in values for x in v):
+            return "list"
+    return "mixed"
+
+
+def _parquet_safe(df: pd.DataFrame) -> bool:
+    """Parquet без потерь: строковые уникальные имена колонок, object-колонки — строки или списки строк."""
+    if not HAS_PYARROW:
+        return False
+    if not all(isinstance(c, str) for c in df.columns) or df.columns.duplicated().any():
+        return False
+    return all(df[c].dtype != object or _column_kind(df[c]) != "mixed" for c in df.columns)
+
+
+def write_frame(df: pd.DataFrame, path: Path) -> Path:
+    """Пишет кадр в path.parquet или (запасной вариант) path.pkl; возвращает итоговый путь."""
+    encoded = encode_mixed_columns(df)
+    if encoded is not None and _parquet_safe(encoded):
+        out = path.with_suffix(".parquet")
+        encoded.to_parquet(out, index=False)
+    else:
+        log.warning("%s: кадр не подходит для Parquet — записан в pickle", path)
+        out = path.with_suffix(".pkl")
+        with open(out, "wb") as f:
+            pickle.dump(df, f, protocol=pickle.HIGHEST_PROTOCOL)
+    return out
+
+
+def read_frame(path: Path) -> pd.DataFrame:
+    parquet = path.with_suffix(".parquet")
+    if parquet.exists():
+        return decode_mixed_columns(_restore_lists(pd.read_parquet(parquet)))
+    with open(path.with_suffix(".pkl"), "rb") as f:
+        return pickle.load(f)
+
+
+def _restore_lists(df: pd.DataFrame) -> pd.DataFrame:
+    """Parquet отдаёт списки как ndarray — возвращаем list, как было при записи."""
+    for c in df.columns:
+        if df[c].dtype == object:
+            first = df[c].dropna()
+            if len(first) and isinstance(first.iloc[0], np.ndarray):
+                df[c] = df[c].map(list, na_action="ignore")
+    return df
+
+
+class DiskCache:
+    """
+    Кэш наборов DataFrame на диске: CACHE_DIR/<name>/<key>/.
+
+    Запись = каталог с кадрами + meta.json. Время последнего доступа — mtime meta.json;
+    при превышении max_bytes удаляются самые давно использованные записи.
+    max_bytes <= 0 выключает кэш.
+
+    hits / misses — счётчики обращений get() в этом процессе.
+    """
+
+    def __init__(self, name: str, max_bytes: int):
+        self.root = CACHE_DIR / name
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str, names=None):
+        """
+        (frames: dict, meta: dict) или None, если записи нет / она битая.
+        names — читать только эти кадры (нет какого-то из них — промах).
+        """
+        if self.max_bytes <= 0:
+            return None
+
+        entry = self.root / key
+        meta_path = entry / "meta.json"
+        try:
+            info = json.loads(meta_path.read_text("utf-8"))
+            frames = {name: read_frame(entry / name) for name in (info["frames"] if names is None else names)}
+            os.utime(meta_path)  # отметка доступа для LRU
+        except Exception:  # нет записи, запись удалена параллельно или повреждена — считаем промахом
+            self.misses += 1
+            return None
+        self.hits += 1
+        return frames, info.get("meta", {})
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses}
+
+    def put(self, key: str, frames: dict, meta: dict | None = None):
+        if self.max_bytes <= 0:
+            return
+
+        try:
+            self.root.mkdir(parents=True, exist_ok=True)
+            tmp = Path(tempfile.mkdtemp(dir=self.root, prefix=".tmp-"))
+        except OSError:
+            return
+
+        try:
+            for name, df in frames.items():
+                write_frame(df, tmp / name)
+            info = {"frames": list(frames), "meta": meta or {}, "created": time.time()}
+            (tmp / "meta.json").write_text(json.dumps(info, ensure_ascii=False, default=str), "utf-8")
+
+            entry = self.root / key
+            shutil.rmtree(entry, ignore_errors=True)
+            os.replace(tmp, entry)
+        except OSError:
+            pass  # кэш — не критичен: не смогли записать, значит в следующий раз распарсим заново
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+        self._evict()
+
+    def clear(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def _evict(self):
+        entries = []
+        for entry in self.root.iterdir():
+            if entry.name.startswith(".") or not entry.is_dir():
+                continue
+            try:
+                last_access = (entry / "meta.json").stat().st_mtime
+                size = sum(f.stat().st_size for f in entry.iterdir())
+            except OSError:
+                continue
+            entries.append((last_access, size, entry))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, entry in sorted(entries, key=lambda e: e[0]):
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
+
+
+def sidecar_frame(source: Path, build, version: int = 1) -> pd.DataFrame:
+    """
+    Кадр build() по файлу source через файл-спутник в CACHE_DIR/sidecar/.
+
+    Спутник — Feather (Arrow IPC): читается целиком в обычный DataFrame (в разы быстрее
+    декодирования xlsx); без pyarrow (или для неподходящих кадров) — pickle.
+    Пересобирается, если изменился mtime source и вместе с ним SHA-256 (или version);
+    просто "тронутый" файл не пересобирается.
+    """
+    source = Path(source)
+    root = CACHE_DIR / "sidecar"
+    base = root / f"{source.stem}-{content_hash(str(source.resolve()))[:12]}"
+    # имя дополняется, а не через with_suffix: в stem бывают точки (db.v2.xlsx → "db.v2-<hash>")
+    meta_path = base.with_name(f"{base.name}.json")
+
+    mtime = source.stat().st_mtime
+    try:
+        meta = json.loads(meta_path.read_text("utf-8"))
+    except (OSError, ValueError):
+        meta = {}
+
+    if meta.get("version") == version:
+        fresh = meta.get("mtime") == mtime
+        if not fresh and meta.get("sha256") == file_hash(source):
+            # содержимое то же — запоминаем новый mtime, чтобы не хешировать каждый раз
+            fresh = True
+            _write_json(meta_path, {**meta, "mtime": mtime})
+        if fresh:
+            try:
+                return _read_sidecar(base, meta["format"])
+            except Exception:  # спутник удалён / повреждён — пересоберём
+                pass
+
+    df = build()
+
+    try:
+        root.mkdir(parents=True, exist_ok=True)
+        fmt = _write_sidecar(df, base)
+        _write_json(meta_path, {"version": version, "mtime": mtime, "sha256": file_hash(source), "format": fmt})
+    except OSError:
+        pass  # спутник — не критичен
+    return df
+
+
+def _write_sidecar(df: pd.DataFrame, base: Path) -> str:
+    fd, tmp = tempfile.mkstemp(dir=base.parent, prefix=".tmp-")
+    os.close(fd)
+    try:
+        encoded = encode_mixed_columns(df)
+        if encoded is not None and _parquet_safe(encoded):  # у Feather те же условия, что у Parquet
+            fmt = "feather"
+            encoded.reset_index(drop=True).to_feather(tmp)
+        else:
+            log.warning("%s: кадр не подходит для Feather — спутник записан в pickle", base)
+            fmt = "pkl"
+            with open(tmp, "wb") as f:
+                pickle.dump(df, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, base.with_name(f"{base.name}.{fmt}"))
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return fmt
+
+
+def _read_sidecar(base: Path, fmt: str) -> pd.DataFrame:
+    path = base.with_name(f"{base.name}.{fmt}")
+    if fmt == "feather":
+        # memory_map не даёт выигрыша: to_pandas() всё равно копирует данные в кадр
+        return decode_mixed_columns(_restore_lists(pd.read_feather(path)))
+    with open(path, "rb") as f:
+        return pickle.load(f)
+
+
+def _write_json(path: Path, data: dict):
+    tmp = path.with_name(f".tmp-{path.name}")
+    tmp.write_text(json.dumps(data), "utf-8")
+    os.replace(tmp, path)
@@ -1,6 +1,42 @@
+import os
+import threading
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+import numpy as np
 import pandas as pd
+from openpyxl import Workbook
+
+from cache import DiskCache, content_hash
+from utils import (
+    FINGERPRINT_COL,
+    format_subclass_key,
+    format_subclass_key_series,
+    normalize_text_for_compare,
+    normalize_text_for_compare_series,
+    subclass_key_series,
+    text_fingerprints,
+)
+
+# Версия логики сравнения — входит в ключ кэша результатов; увеличить при изменении результата
+COMPARE_VERSION = 3
 
-from utils import normalize_text_for_compare, normalize_subclass_simple
+# Повторяющийся Subclass_code на одной стороне (пересечение листов, 9000.149999 и 9000.15 → 900015):
+#   first — оставить первую строку, last — последнюю, error — ValueError.
+# Без этого outer merge дал бы декартово произведение строк.
+DUPLICATE_POLICIES = ("first", "last", "error")
+DUPLICATE_POLICY = os.environ.get("SHAMS_DUPLICATE_KEYS", "first")
+
+# Сравнение по шардам-Division в процессах (compare_sharded): число воркеров (<= 1 — выключено,
+# по умолчанию; включается явно, как параллельный парсинг) и сколько строк должно быть
+# в двух файлах вместе, чтобы запуск процессов окупался
+COMPARE_WORKERS = int(os.environ.get("SHAMS_COMPARE_WORKERS", "1"))
+SHARDED_MIN_ROWS = int(os.environ.get("SHAMS_COMPARE_SHARDED_ROWS", "200000"))
+
+# Лимит дискового кэша результатов сравнения, МБ (0 — выключить)
+COMPARE_CACHE_MB = int(os.environ.get("SHAMS_COMPARE_CACHE_MB", "128"))
+_compare_cache = DiskCache("compare", COMPARE_CACHE_MB * 1024 * 1024)
 
 
 def _to_scalar(x):
@@ -35,6 +71,13 @@ def _clean_display_text(val) -> str:
     return s.strip()
 
 
+def _clean_display_series(values: pd.Series) -> pd.Series:
+    """_clean_display_text для колонки: считается один раз на различное значение (по str(val))."""
+    codes, uniques = pd.factorize(values.astype(str).where(values.notna()))
+    cleaned = np.array([_clean_display_text(u) for u in uniques] + [""], dtype=object)
+    return pd.Series(cleaned[codes], index=values.index, dtype=object)
+
+
 def _fmt_log(status: str, old_val, new_val) -> str:
     old_val = _to_scalar(old_val)
     new_val = _to_scalar(new_val)
@@ -56,147 +99,447 @@ def compare_shams(
     df_new: pd.DataFrame,
     column_mapping: dict,
     compare_cols: list | None = None,  # <-- НОВОЕ: какие new_col сравнивать (кроме Description)
+    workers: int | None = None,
+    duplicates: str = DUPLICATE_POLICY,
 ) -> pd.DataFrame:
     """
     Результат:
-    - Subclass_code
+    - Subclass_code (NNNN.NN; merge внутри — по int32-ключу subclass_key)
     - status
     - Description. Лог изменений (это Subclass_en old/new)
     - для каждой выбранной сопоставленной колонки: "<new_col>. Лог изменений"
     - для новых колонок без соответствия: "<new_col>" (значение из new)
+
+    workers > 1 — параллельно по Division (см. compare_sharded).
+    duplicates — что делать с повторяющимся ключом (DUPLICATE_POLICIES); отброшенные
+    строки — в result.attrs["duplicates"] (только если они были).
     """
+    if workers and workers > 1:
+        return compare_sharded(df_old, df_new, column_mapping, compare_cols, workers, duplicates)[0]
+    return CompareSession(df_old, df_new, duplicates=duplicates).result(column_mapping, compare_cols)
 
-    df_old = df_old.copy()
-    df_new = df_new.copy()
 
-    # чистим имена колонок
-    df_old.columns = [str(c).strip() for c in df_old.columns]
-    df_new.columns = [str(c).strip() for c in df_new.columns]
+def compare_sharded(
+    df_old: pd.DataFrame,
+    df_new: pd.DataFrame,
+    column_mapping: dict,
+    compare_cols: list | None = None,
+    workers: int | None = None,
+    duplicates: str = DUPLICATE_POLICY,
+) -> tuple:
+    """
+    compare_shams по шардам-Division (первые две цифры ключа: key // 10000) в ProcessPoolExecutor.
 
-    # ключ
-    df_old["Subclass_code"] = df_old["Subclass"].apply(normalize_subclass_simple)
-    df_new["Subclass_code"] = df_new["Subclass"].apply(normalize_subclass_simple)
+    Ключи разных Division не пересекаются, поэтому шарды сравниваются независимо;
+    результаты склеиваются по возрастанию Division — то есть в порядке ключа, как после merge.
+    Возвращает (df_compare, df_stats); статистика — из счётчиков статусов по шардам.
+    """
+    old_parts = dict(_division_shards(df_old))
+    new_parts = dict(_division_shards(df_new))
+    divisions = sorted(set(old_parts) | set(new_parts))
 
-    df_old = df_old[df_old["Subclass_code"].notna()]
-    df_new = df_new[df_new["Subclass_code"].notna()]
+    tasks = [
+        (old_parts.get(d, df_old.iloc[:0]), new_parts.get(d, df_new.iloc[:0]), column_mapping, compare_cols, duplicates)
+        for d in divisions
+    ]
 
-    # mapping: new_col -> old_col|None
-    mapped_pairs_all = []
-    new_only_cols = []
+    if not tasks:
+        df_compare = compare_shams(df_old, df_new, column_mapping, compare_cols, duplicates=duplicates)
+        return df_compare, comparison_stats(df_compare)
 
-    for new_col, old_col in (column_mapping or {}).items():
-        if old_col:
-            mapped_pairs_all.append((old_col, new_col))
-        else:
-            new_only_cols.append(new_col)
+    if workers and workers > 1 and len(tasks) > 1:
+        # spawn, а не fork: вызывается из многопоточного сервера Streamlit
+        with ProcessPoolExecutor(max_workers=min(workers, len(tasks)), mp_context=get_context("spawn")) as pool:
+            results = list(pool.map(_compare_shard, tasks))
+    else:
+        results = [_compare_shard(task) for task in tasks]
 
-    # какие сопоставленные колонки реально сравниваем (кроме Description)
-    compare_set = set(compare_cols or [])
-    mapped_pairs_to_compare = [(o, n) for (o, n) in mapped_pairs_all if n in compare_set]
-
-    # Description = Subclass_en
-    BASE_OLD = "Subclass_en_old"
-    BASE_NEW = "Subclass_en_new"
-    LOG_DESC = "Description. Лог изменений"
-
-    # суффиксы
-    df_old = df_old.add_suffix("_old").rename(columns={"Subclass_code_old": "Subclass_code"})
-    df_new = df_new.add_suffix("_new").rename(columns={"Subclass_code_new": "Subclass_code"})
-
-    df = pd.merge(df_old, df_new, on="Subclass_code", how="outer", indicator=True)
-
-    # первичный статус
-    def _initial_status(row):
-        if row["_merge"] == "left_only":
-            return "deleted"
-        if row["_merge"] == "right_only":
-            return "added"
-        return "potentially_changed"
-
-    df["status"] = df.apply(_initial_status, axis=1)
-
-    # diff только по: Description + выбранные текстовые сопоставленные
-    diff_cols = []
-    for _, row in df.iterrows():
-        diffs = []
-        if row["status"] == "potentially_changed":
-            old_val = normalize_text_for_compare(_to_scalar(row.get(BASE_OLD, "")))
-            new_val = normalize_text_for_compare(_to_scalar(row.get(BASE_NEW, "")))
-            if old_val != new_val:
-                diffs.append("Description")
-
-            for old_col, new_col in mapped_pairs_to_compare:
-                old_v = normalize_text_for_compare(_to_scalar(row.get(f"{old_col}_old", "")))
-                new_v = normalize_text_for_compare(_to_scalar(row.get(f"{new_col}_new", "")))
-                if old_v != new_v:
-                    diffs.append(new_col)
-
-        diff_cols.append(diffs)
-
-    df["diff_columns"] = diff_cols
-
-    def _final_status(row):
-        if row["status"] in ("added", "deleted"):
-            return row["status"]
-        if len(row["diff_columns"]) > 0:
-            return "changed"
-        return "not changed"
-
-    df["status"] = df.apply(_final_status, axis=1)
-
-    # === логи ===
-    df[LOG_DESC] = df.apply(
-        lambda r: _fmt_log(r["status"], r.get(BASE_OLD, ""), r.get(BASE_NEW, "")),
-        axis=1,
-    )
+    # attrs (duplicates) шардов снимаем до concat и сводим отдельно
+    dups = [part.attrs.pop("duplicates") for part, _ in results if "duplicates" in part.attrs]
+    df_compare = pd.concat([part for part, _ in results], ignore_index=True)
+    if dups:
+        df_compare.attrs["duplicates"] = pd.concat(dups, ignore_index=True)
+
+    counts = Counter()
+    for _, shard_counts in results:
+        counts.update(shard_counts)
+
+    return df_compare, _stats_from_counts(counts)
+
+
+def _division_shards(df: pd.DataFrame):
+    """(Division, строки df) — строки без ключа отбрасываются, как в compare_shams."""
+    names = [str(c).strip() for c in df.columns]
+    keys = subclass_key_series(df.iloc[:, names.index("Subclass")])
+    division = (keys // 10000).to_numpy()
+    valid = keys.notna().to_numpy()
+    for d in pd.unique(division[valid]):
+        yield int(d), df[valid & (division == d)]
+
+
+def _compare_shard(task) -> tuple:
+    """Задача для процесса-воркера: сравнить один шард → (результат, счётчики статусов)."""
+    df_old, df_new, column_mapping, compare_cols, duplicates = task
+    part = CompareSession(df_old, df_new, duplicates=duplicates).result(column_mapping, compare_cols)
+    return part, part["status"].value_counts().to_dict()
+
+
+# Description = Subclass_en
+BASE_COL = "Subclass_en"
+LOG_DESC = "Description. Лог изменений"
+
+# статусы, у которых есть лог изменений
+LOG_STATUSES = ("changed", "deleted", "added")
+
+
+class CompareSession:
+    """
+    Сравнение двух df_full, переживающее правки сопоставления колонок.
+
+    merge по ключу и первичный статус считаются один раз; нормализация — по колонкам,
+    различия и логи — по парам (old_col, new_col), всё кэшируется.
+    Логи строятся только для строк со статусом changed / added / deleted.
+
+    Описание (BASE_COL) сравнивается по uint64-отпечаткам нормализованного текста —
+    колонка FINGERPRINT_COL из build_frames (нет её — отпечатки считаются здесь):
+    разные отпечатки → описание изменилось; равные → не изменилось, строки не сравниваются.
+    Риск принят осознанно: при коллизии 64-битного хеша (~2**-64 на пару разных описаний,
+    для 10**6 строк — порядка 1e-13) изменённое описание будет считаться "not changed".
+    Остальные выбранные колонки сравниваются точно — по нормализованным значениям.
+    """
+
+    def __init__(
+        self,
+        df_old: pd.DataFrame,
+        df_new: pd.DataFrame,
+        old_normalized: pd.DataFrame | None = None,
+        duplicates: str = DUPLICATE_POLICY,
+    ):
+        if duplicates not in DUPLICATE_POLICIES:
+            raise ValueError(f"Неизвестная политика дублей: {duplicates} (доступны: {', '.join(DUPLICATE_POLICIES)})")
+
+        # old_normalized — normalize_compare_columns(df_old), если уже посчитан (Baseline / снимок)
+        if old_normalized is not None and len(old_normalized) != len(df_old):
+            old_normalized = None
+        self._old_normalized = old_normalized
+
+        df_old = df_old.copy()
+        df_new = df_new.copy()
+
+        # чистим имена колонок
+        df_old.columns = [str(c).strip() for c in df_old.columns]
+        df_new.columns = [str(c).strip() for c in df_new.columns]
+
+        # готовые отпечатки описания берём до merge: uint64 с пропусками после outer merge стал бы float;
+        # сама колонка служебная — в сравнение и выдачу не идёт
+        self._stored_fingerprints = (_stored_fingerprints(df_old), _stored_fingerprints(df_new))
+        df_old = df_old.drop(columns=FINGERPRINT_COL, errors="ignore")
+        df_new = df_new.drop(columns=FINGERPRINT_COL, errors="ignore")
+
+        # позиция строки в исходных df — для old_normalized и готовых отпечатков
+        df_old["__row"] = np.arange(len(df_old))
+        df_new["__row"] = np.arange(len(df_new))
+
+        # ключ: int32 (4321.02 → 432102) — merge идёт по целым, а не по строкам
+        df_old["Subclass_code"] = subclass_key_series(df_old["Subclass"])
+        df_new["Subclass_code"] = subclass_key_series(df_new["Subclass"])
 
-    log_cols = []
-    for old_col, new_col in mapped_pairs_to_compare:
-        log_name = f"{new_col}. Лог изменений"
-        log_cols.append(log_name)
-        df[log_name] = df.apply(
-            lambda r, oc=old_col, nc=new_col: _fmt_log(
-                r["status"],
-                r.get(f"{oc}_old", ""),
-                r.get(f"{nc}_new", ""),
-            ),
-            axis=1,
+        df_old = df_old[df_old["Subclass_code"].notna()].astype({"Subclass_code": "int32"})
+        df_new = df_new[df_new["Subclass_code"].notna()].astype({"Subclass_code": "int32"})
+
+        # ключ на каждой стороне уникален — merge строго один-к-одному
+        df_old, dup_old = _drop_duplicate_keys(df_old, "old", duplicates)
+        df_new, dup_new = _drop_duplicate_keys(df_new, "new", duplicates)
+        reports = [r for r in (dup_old, dup_new) if len(r)]
+        self.duplicates = pd.concat(reports, ignore_index=True) if reports else dup_old
+
+        # суффиксы
+        df_old = df_old.add_suffix("_old").rename(columns={"Subclass_code_old": "Subclass_code"})
+        df_new = df_new.add_suffix("_new").rename(columns={"Subclass_code_new": "Subclass_code"})
+
+        df = pd.merge(df_old, df_new, on="Subclass_code", how="outer", indicator=True, validate="one_to_one")
+
+        # первичный статус — по индикатору merge
+        merge = df["_merge"].to_numpy()
+        self.df = df
+        self.status = np.select(
+            [merge == "left_only", merge == "right_only"],
+            ["deleted", "added"],
+            "potentially_changed",
+        ).astype(object)
+        self.norm_to_real = {_norm_colname(c): c for c in df.columns}
+        self.codes = format_subclass_key_series(df["Subclass_code"])  # ключ в выдаче — NNNN.NN
+
+        self._potential = self.status == "potentially_changed"
+        self._normalized = {}  # колонка -> нормализованные значения (ndarray) по строкам
+        self._description_fingerprints = None  # (old, new) uint64 по строкам merge
+        self._changed = {}  # (old_col, new_col) -> маска строк, где пара различается
+        self._logs = {}  # (old_col, new_col) -> {"done": mask, status: ndarray} логов по строкам
+        # в приложении сессия общая для всех сессий Streamlit (cache_resource) — кэши выше
+        # дополняются из разных потоков, поэтому result выполняется под блокировкой
+        self._lock = threading.Lock()
+
+    def _values(self, col: str) -> pd.Series:
+        """Значения колонки по строкам — как row.get(col, "") с _to_scalar."""
+        if col not in self.df.columns:
+            return pd.Series("", index=self.df.index, dtype=object)
+        values = self.df[col]
+        if isinstance(values, pd.DataFrame):  # дубли имён колонок
+            return pd.Series(_first_non_null(values), index=values.index, dtype=object)
+        return values
+
+    def normalized(self, col: str) -> np.ndarray:
+        """normalize_text_for_compare по колонке — один раз на колонку и на различное значение."""
+        if col not in self._normalized:
+            pre = self._pre_normalized(col)
+            if pre is None:
+                pre = normalize_text_for_compare_series(self._values(col)).to_numpy()
+            self._normalized[col] = pre
+        return self._normalized[col]
+
+    def _pre_normalized(self, col: str):
+        """Колонка "<old_col>_old" из old_normalized, разложенная по строкам merge (или None)."""
+        if self._old_normalized is None or not col.endswith("_old"):
+            return None
+        base = col[: -len("_old")]
+        if base not in self._old_normalized.columns or not isinstance(self.df.get(col), pd.Series):
+            return None
+
+        rows = self.df["__row_old"]
+        values = self._old_normalized[base].to_numpy(dtype=object)
+        # строки только из нового файла (right_only) — в старом пусто → ""
+        return np.where(rows.isna(), "", values[rows.fillna(0).astype(int).to_numpy()])
+
+    def description_fingerprints(self) -> tuple:
+        """(old, new): uint64-отпечатки нормализованного описания по строкам merge."""
+        if self._description_fingerprints is None:
+            self._description_fingerprints = tuple(
+                self._side_fingerprints(side, stored)
+                for side, stored in zip(("old", "new"), self._stored_fingerprints)
+            )
+        return self._description_fingerprints
+
+    def _side_fingerprints(self, side: str, stored) -> np.ndarray:
+        if stored is None:
+            return pd.util.hash_array(self.normalized(f"{BASE_COL}_{side}"))
+        # строки только с другой стороны — пустое описание, как у normalized
+        rows = self.df[f"__row_{side}"]
+        return np.where(rows.isna(), _EMPTY_FINGERPRINT, stored[rows.fillna(0).astype(int).to_numpy()])
+
+    def changed(self, old_col: str, new_col: str) -> np.ndarray:
+        """Маска строк, где пара колонок различается после нормализации."""
+        pair = (old_col, new_col)
+        if pair not in self._changed:
+            if pair == (BASE_COL, BASE_COL):
+                fp_old, fp_new = self.description_fingerprints()
+                self._changed[pair] = fp_old != fp_new
+            else:
+                self._changed[pair] = self.normalized(f"{old_col}_old") != self.normalized(f"{new_col}_new")
+        return self._changed[pair]
+
+    def log(self, old_col: str, new_col: str, status: np.ndarray) -> np.ndarray:
+        """Лог изменений пары (как _fmt_log) по итоговым статусам строк; "not changed" → ""."""
+        pair = (old_col, new_col)
+        logs = self._logs.get(pair)
+        if logs is None:
+            n = len(self.df)
+            logs = self._logs[pair] = {"done": np.zeros(n, dtype=bool)}
+            for s in LOG_STATUSES:
+                logs[s] = np.full(n, "", dtype=object)
+
+        # досчитываем только строки с логом, которых ещё не было
+        todo = (status != "not changed") & ~logs["done"]
+        if todo.any():
+            old_s = _clean_display_series(self._values(f"{old_col}_old")[todo])
+            new_s = _clean_display_series(self._values(f"{new_col}_new")[todo])
+            logs["changed"][todo] = ("OLD: " + old_s + "\nNEW: " + new_s).str.strip().to_numpy()
+            logs["deleted"][todo] = np.where(old_s != "", "OLD: " + old_s, "")
+            logs["added"][todo] = np.where(new_s != "", "NEW: " + new_s, "")
+            logs["done"] |= todo
+
+        return np.select([status == s for s in LOG_STATUSES], [logs[s] for s in LOG_STATUSES], "").astype(object)
+
+    def result(self, column_mapping: dict, compare_cols: list | None = None) -> pd.DataFrame:
+        with self._lock:
+            return self._result(column_mapping, compare_cols)
+
+    def _result(self, column_mapping: dict, compare_cols: list | None) -> pd.DataFrame:
+        # mapping: new_col -> old_col|None
+        mapped_pairs_all = []
+        new_only_cols = []
+
+        for new_col, old_col in (column_mapping or {}).items():
+            if old_col:
+                mapped_pairs_all.append((old_col, new_col))
+            else:
+                new_only_cols.append(new_col)
+
+        # какие сопоставленные колонки реально сравниваем (кроме Description)
+        compare_set = set(compare_cols or [])
+        mapped_pairs_to_compare = [(o, n) for (o, n) in mapped_pairs_all if n in compare_set]
+
+        # сравниваем только: Description + выбранные текстовые сопоставленные
+        changed = np.logical_or.reduce(
+            [self.changed(old_col, new_col) for old_col, new_col in [(BASE_COL, BASE_COL)] + mapped_pairs_to_compare]
         )
 
-    # новые колонки без соответствия: вытаскиваем из *_new устойчиво
-    def _norm_colname(x: str) -> str:
-        if x is None:
-            return ""
-        s = str(x).replace("\u00A0", " ")
-        s = s.replace("\n", " ").replace("\r", " ")
-        s = " ".join(s.split())
-        return s.strip().lower()
+        status = np.where(
+            self._potential,
+            np.where(changed, "changed", "not changed"),
+            self.status,
+        ).astype(object)
+
+        out = pd.DataFrame(index=self.df.index)
+        out["Subclass_code"] = self.codes
+        out["status"] = status
+
+        # === логи ===
+        out[LOG_DESC] = self.log(BASE_COL, BASE_COL, status)
 
-    norm_to_real = {_norm_colname(c): c for c in df.columns}
+        log_cols = []
+        for old_col, new_col in mapped_pairs_to_compare:
+            log_name = f"{new_col}. Лог изменений"
+            log_cols.append(log_name)
+            out[log_name] = self.log(old_col, new_col, status)
+
+        # новые колонки без соответствия: вытаскиваем из *_new устойчиво
+        new_only_out_cols = []
+        for new_col in new_only_cols:
+            wanted = f"{new_col}_new"
+            real_col = wanted if wanted in self.df.columns else self.norm_to_real.get(_norm_colname(wanted))
+            if real_col:
+                out_name = str(new_col).strip()
+                out[out_name] = self._values(real_col)  # повтор имени — первое непустое
+                new_only_out_cols.append(out_name)
+
+        # итог
+        final_cols = ["Subclass_code", "status", LOG_DESC] + log_cols + new_only_out_cols
+        out = out[final_cols]
+        if len(self.duplicates):
+            out.attrs["duplicates"] = self.duplicates
+        return out
+
+
+def _drop_duplicate_keys(df: pd.DataFrame, side: str, policy: str) -> tuple:
+    """
+    Оставляет одну строку на Subclass_code по policy. Возвращает (df, отчёт):
+    отчёт — все строки с повторяющимся ключом (side, Subclass_code, Subclass, kept).
+    """
+    key = df["Subclass_code"]
+    dup_mask = key.duplicated(keep=False)  # хеш-индекс по ключу, без сортировки
+    if not dup_mask.any():
+        return df, pd.DataFrame(columns=["side", "Subclass_code", "Subclass", "kept"])
+
+    if policy == "error":
+        codes = ", ".join(format_subclass_key(k) for k in key[dup_mask].unique()[:10])
+        raise ValueError(f"Повторяющиеся Subclass_code ({side}): {codes}")
+
+    keep = ~key.duplicated(keep=policy)
+    report = pd.DataFrame({
+        "side": side,
+        "Subclass_code": format_subclass_key_series(key[dup_mask]),
+        "Subclass": df.loc[dup_mask, "Subclass"],
+        "kept": keep[dup_mask],
+    }).reset_index(drop=True)
+    return df[keep], report
+
+
+_EMPTY_FINGERPRINT = text_fingerprints([""])[0]
+
+
+def _first_non_null(values: pd.DataFrame) -> np.ndarray:
+    """Колонки с одним именем → по строкам первое непустое значение, иначе значение первой колонки."""
+    arr = values.to_numpy(dtype=object)
+    first = pd.notna(arr).argmax(axis=1)  # нет непустых → 0, то есть первая колонка
+    return arr[np.arange(len(arr)), first]
+
+
+def _stored_fingerprints(df: pd.DataFrame):
+    """Колонка FINGERPRINT_COL (uint64, одна) как ndarray по строкам df, иначе None."""
+    if list(df.columns).count(FINGERPRINT_COL) != 1 or df[FINGERPRINT_COL].dtype != np.uint64:
+        return None
+    return df[FINGERPRINT_COL].to_numpy()
+
+
+def _norm_colname(x: str) -> str:
+    if x is None:
+        return ""
+    s = str(x).replace("\u00A0", " ")
+    s = s.replace("\n", " ").replace("\r", " ")
+    s = " ".join(s.split())
+    return s.strip().lower()
+
+
+def compare_identical(
+    df: pd.DataFrame,
+    column_mapping: dict,
+    compare_cols: list | None = None,
+) -> pd.DataFrame:
+    """
+    То же, что compare_shams(df, df, column_mapping, compare_cols), но без merge и построчного diff:
+    новый файл совпал с базовым, все строки — "not changed", логи пустые.
+    """
+    df = df.copy()
+    df.columns = [str(c).strip() for c in df.columns]
+    df = df.drop(columns=FINGERPRINT_COL, errors="ignore")  # служебная, как в CompareSession
+
+    key = subclass_key_series(df["Subclass"])
+    df = df[key.notna()]
+    key = key[key.notna()].astype("int32")
+
+    # дубли ключа (декартово произведение в merge) или дубли колонок — честное сравнение
+    if key.duplicated().any() or df.columns.duplicated().any():
+        return compare_shams(df, df, column_mapping, compare_cols)
+
+    compare_set = set(compare_cols or [])
+    log_cols = [
+        f"{new_col}. Лог изменений"
+        for new_col, old_col in (column_mapping or {}).items()
+        if old_col and new_col in compare_set
+    ]
+
+    # outer merge отдаёт ключи отсортированными
+    order = key.to_numpy().argsort(kind="stable")
+    df = df.iloc[order].reset_index(drop=True)
+
+    out = pd.DataFrame({"Subclass_code": format_subclass_key_series(key.iloc[order].to_numpy())})
+    out["status"] = "not changed"
+    out[LOG_DESC] = ""
+    for log_name in log_cols:
+        out[log_name] = ""
+
+    # новые колонки без соответствия — как в compare_shams: "<new_col>_new" или совпадение по нормализованному имени
+    new_cols = {f"{c}_new": c for c in df.columns if c != "Subclass_code"}
+    norm_to_real = {_norm_colname(c): c for c in new_cols}
 
     new_only_out_cols = []
-    for new_col in new_only_cols:
+    for new_col, old_col in (column_mapping or {}).items():
+        if old_col:
+            continue
         wanted = f"{new_col}_new"
-        real_col = wanted if wanted in df.columns else norm_to_real.get(_norm_colname(wanted))
+        real_col = wanted if wanted in new_cols else norm_to_real.get(_norm_colname(wanted))
         if real_col:
             out_name = str(new_col).strip()
-            df[out_name] = df[real_col]
+            out[out_name] = df[new_cols[real_col]].to_numpy()
             new_only_out_cols.append(out_name)
 
-    # итог
     final_cols = ["Subclass_code", "status", LOG_DESC] + log_cols + new_only_out_cols
-    final_cols = [c for c in final_cols if c in df.columns]
-    return df[final_cols]
+    return out[final_cols]
 
 
 def comparison_stats(df_compare: pd.DataFrame) -> pd.DataFrame:
-    total_old = df_compare["status"].isin(["not changed", "changed", "deleted"]).sum()
-    total_new = df_compare["status"].isin(["not changed", "changed", "added"]).sum()
+    return _stats_from_counts(df_compare["status"].value_counts().to_dict())
 
-    added = (df_compare["status"] == "added").sum()
-    deleted = (df_compare["status"] == "deleted").sum()
-    changed = (df_compare["status"] == "changed").sum()
-    not_changed = (df_compare["status"] == "not changed").sum()
+
+def _stats_from_counts(counts: dict) -> pd.DataFrame:
+    """Таблица статистики по счётчикам статусов {status: число строк}."""
+    added = counts.get("added", 0)
+    deleted = counts.get("deleted", 0)
+    changed = counts.get("changed", 0)
+    not_changed = counts.get("not changed", 0)
+
+    total_old = not_changed + changed + deleted
+    total_new = not_changed + changed + added
 
     return pd.DataFrame({
         "metric": [
@@ -207,10 +550,276 @@ def comparison_stats(df_compare: pd.DataFrame) -> pd.DataFrame:
             "Изменено (по выбранным столбцам)",
             "Не изменено",
         ],
-        "value": [total_old, total_new, added, deleted, changed, not_changed],
+        "value": np.array([total_old, total_new, added, deleted, changed, not_changed], dtype="int64"),
     })
 
 
+def normalize_compare_columns(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    normalize_text_for_compare для текстовых (object) колонок df, по строкам df.
+    Считается один раз для базового каталога и передаётся в CompareSession(old_normalized=...).
+    Числовые колонки не берём: после outer merge они становятся float и текст меняется (5 → 5.0).
+    """
+    names = [str(c).strip() for c in df.columns]
+    out = {}
+    for col, name in zip(df.columns, names):
+        if names.count(name) == 1 and df[col].dtype == object:
+            out[name] = normalize_text_for_compare_series(df[col]).to_numpy()
+    return pd.DataFrame(out, index=pd.RangeIndex(len(df)))
+
+
+def compare_result_key(
+    old_key: str,
+    new_key: str,
+    column_mapping: dict,
+    compare_cols: list | None = None,
+    *,
+    parser_version=None,
+    duplicates: str = DUPLICATE_POLICY,
+) -> str:
+    """
+    Ключ результата сравнения: хеши обоих файлов + канонический вид mapping и compare_cols.
+    parser_version — версия парсера, которым получены кадры (передаёт вызывающий код):
+    после изменения парсинга старые результаты не переиспользуются.
+    duplicates — политика повторяющихся ключей, с которой считается результат
+    (другая политика — другой результат, а "error" должна снова проверить дубли).
+    Порядок пар mapping сохраняется (от него зависит порядок колонок результата),
+    compare_cols — множество, порядок не важен.
+    """
+    return content_hash(
+        COMPARE_VERSION,
+        parser_version,
+        duplicates,
+        old_key,
+        new_key,
+        [[str(new_col), old_col] for new_col, old_col in (column_mapping or {}).items()],
+        sorted({str(c) for c in (compare_cols or [])}),
+    )
+
+
+def cached_comparison(key: str, compute) -> tuple:
+    """
+    (df_compare, df_stats) из дискового кэша по compare_result_key;
+    при промахе — compute() (возвращает df_compare), статистика и запись в кэш.
+    """
+    hit = _compare_cache.get(key)
+    if hit is not None:
+        frames, _ = hit
+        df_compare = frames["compare"]
+        if "duplicates" in frames:
+            df_compare.attrs["duplicates"] = frames["duplicates"]
+        return df_compare, frames["stats"]
+
+    df_compare = compute()
+    df_stats = comparison_stats(df_compare)
+
+    # attrs в файлы кадров не пишем — отчёт о дублях отдельным кадром
+    frames = {"compare": df_compare.copy(), "stats": df_stats}
+    frames["compare"].attrs = {}
+    if "duplicates" in df_compare.attrs:
+        frames["duplicates"] = df_compare.attrs["duplicates"]
+    _compare_cache.put(key, frames)
+    return df_compare, df_stats
+
+
+def compare_cache_stats() -> dict:
+    """Счётчики попаданий/промахов кэша результатов сравнения в этом процессе."""
+    return _compare_cache.stats()
+
+
+# ================== ПОТОКОВОЕ СРАВНЕНИЕ ==================
+# Для очень больших каталогов: без merge в памяти. Обе стороны — итераторы пар
+# (ключ, запись), отсортированные по ключу; результат — генератор записей.
+
+# Сколько строк DataFrame превращать в записи за раз (keyed_records)
+RECORDS_CHUNK = 10_000
+
+
+def keyed_records(df: pd.DataFrame, chunk_size: int = RECORDS_CHUNK) -> "KeyedRecords":
+    """(int-ключ Subclass, запись-dict) из df_full по возрастанию ключа — вход compare_streaming."""
+    return KeyedRecords(df, chunk_size)
+
+
+class KeyedRecords:
+    """
+    Итерируемые записи df_full по возрастанию ключа; строки без ключа пропускаются (как в compare_shams).
+
+    Память: df уже загружен целиком, ключи сортируются (int64 на строку), записи-dict
+    создаются кусками по chunk_size строк. Потоковый здесь только merge-join в
+    compare_streaming, а не чтение файла: xlsx не упорядочен по ключу.
+
+    columns — имена колонок записей (очищенные, без повторов и служебной FINGERPRINT_COL):
+    по ним compare_streaming находит новые колонки без соответствия и при пустой стороне.
+    Повтор имени колонки — первое непустое значение, как в CompareSession.
+    """
+
+    def __init__(self, df: pd.DataFrame, chunk_size: int = RECORDS_CHUNK):
+        self.df = df
+        self.chunk_size = chunk_size
+
+        names = [str(c).strip() for c in df.columns]
+        self._subclass = names.index("Subclass")
+        self._positions = {}  # имя -> позиции колонок df с этим именем
+        for i, name in enumerate(names):
+            if name != FINGERPRINT_COL:
+                self._positions.setdefault(name, []).append(i)
+        self.columns = list(self._positions)
+
+    def __iter__(self):
+        keys = subclass_key_series(self.df.iloc[:, self._subclass]).reset_index(drop=True)
+        keys = keys[keys.notna()].astype("int64").sort_values(kind="stable")
+        positions = keys.index.to_numpy()
+
+        for start in range(0, len(positions), self.chunk_size):
+            rows = positions[start:start + self.chunk_size]
+            chunk = pd.DataFrame({name: self._column(rows, cols) for name, cols in self._positions.items()})
+            for key, record in zip(keys.iloc[start:start + self.chunk_size], chunk.to_dict("records")):
+                yield int(key), record
+
+    def _column(self, rows, cols: list) -> np.ndarray:
+        values = self.df.iloc[rows, cols]
+        return values.iloc[:, 0].to_numpy() if len(cols) == 1 else _first_non_null(values)
+
+
+def _key_groups(records, side: str, policy: str):
+    """
+    (ключ, запись) по отсортированным записям: из подряд идущих записей с одним ключом
+    остаётся одна по policy (first / last / error). Проверяет сортировку.
+    """
+    group_key, group = None, []
+    for key, record in records:
+        if group and key != group_key:
+            if key < group_key:
+                raise ValueError(f"Записи не отсортированы по ключу: {key} после {group_key}")
+            yield group_key, _pick_duplicate(group_key, group, side, policy)
+            group = []
+        group_key = key
+        group.append(record)
+    if group:
+        yield group_key, _pick_duplicate(group_key, group, side, policy)
+
+
+def _pick_duplicate(key, group: list, side: str, policy: str) -> dict:
+    if len(group) > 1 and policy == "error":
+        raise ValueError(f"Повторяющиеся Subclass_code ({side}): {format_subclass_key(key)}")
+    return group[-1] if policy == "last" else group[0]
+
+
+def compare_streaming(
+    old_records,
+    new_records,
+    column_mapping: dict,
+    compare_cols: list | None = None,
+    duplicates: str = DUPLICATE_POLICY,
+):
+    """
+    Потоковый compare_shams: merge-join двух отсортированных итераторов keyed_records.
+
+    Отдаёт записи-dict с теми же колонками и в том же порядке строк, что и compare_shams
+    (Subclass_code — NNNN.NN). Сам merge-join держит в памяти только текущую группу
+    записей с одним ключом (границы памяти источников — см. KeyedRecords).
+    Отличие: числа не превращаются во float, как после outer merge
+    (в логе "5", а не "5.0"). Повторяющиеся ключи — по политике duplicates, как в compare_shams.
+    Новые колонки без соответствия берутся из new_records.columns (KeyedRecords),
+    для простого итератора — из первой записи new.
+    """
+    if duplicates not in DUPLICATE_POLICIES:
+        raise ValueError(f"Неизвестная политика дублей: {duplicates} (доступны: {', '.join(DUPLICATE_POLICIES)})")
+
+    new_only_cols = []
+    mapped_pairs_all = []
+    for new_col, old_col in (column_mapping or {}).items():
+        if old_col:
+            mapped_pairs_all.append((old_col, new_col))
+        else:
+            new_only_cols.append(new_col)
+
+    compare_set = set(compare_cols or [])
+    pairs = [(BASE_COL, BASE_COL)] + [(o, n) for (o, n) in mapped_pairs_all if n in compare_set]
+    log_names = [LOG_DESC] + [f"{n}. Лог изменений" for _, n in pairs[1:]]
+
+    def _resolve_new_only(columns):
+        norm_to_real = {_norm_colname(f"{c}_new"): c for c in columns}
+        resolved = {}
+        for new_col in new_only_cols:
+            wanted = str(new_col)
+            real = wanted if wanted in columns else norm_to_real.get(_norm_colname(f"{new_col}_new"))
+            if real is not None:
+                resolved[str(new_col).strip()] = real
+        return resolved
+
+    # new_col -> колонка записи new: по new_records.columns, иначе — по первой записи new
+    new_columns = getattr(new_records, "columns", None)
+    new_only_real = _resolve_new_only(list(new_columns)) if new_columns is not None else None
+
+    def _row(key, old, new):
+        if old is None:
+            status = "added"
+        elif new is None:
+            status = "deleted"
+        else:
+            changed = any(
+                normalize_text_for_compare(old.get(o, "")) != normalize_text_for_compare(new.get(n, ""))
+                for o, n in pairs
+            )
+            status = "changed" if changed else "not changed"
+
+        row = {"Subclass_code": format_subclass_key(key), "status": status}
+        for log_name, (o, n) in zip(log_names, pairs):
+            old_val = old.get(o, "") if old is not None else np.nan
+            new_val = new.get(n, "") if new is not None else np.nan
+            row[log_name] = _fmt_log(status, old_val, new_val)
+        for out_name, real in (new_only_real or {}).items():
+            row[out_name] = new.get(real, np.nan) if new is not None else np.nan
+        return row
+
+    old_groups = _key_groups(old_records, "old", duplicates)
+    new_groups = _key_groups(new_records, "new", duplicates)
+    old_g = next(old_groups, None)
+    new_g = next(new_groups, None)
+
+    while old_g is not None or new_g is not None:
+        if new_g is not None and new_only_real is None:
+            new_only_real = _resolve_new_only(new_g[1])
+
+        if new_g is None or (old_g is not None and old_g[0] < new_g[0]):
+            yield _row(old_g[0], old_g[1], None)
+            old_g = next(old_groups, None)
+        elif old_g is None or new_g[0] < old_g[0]:
+            yield _row(new_g[0], None, new_g[1])
+            new_g = next(new_groups, None)
+        else:
+            yield _row(old_g[0], old_g[1], new_g[1])
+            old_g = next(old_groups, None)
+            new_g = next(new_groups, None)
+
+
+def write_comparison_xlsx(records, target, sheet_name: str = "for_review") -> int:
+    """
+    Пишет записи compare_streaming в xlsx построчно (openpyxl write_only — книга
+    в памяти не собирается). Заголовок — ключи первой записи.
+    target — путь или файловый объект. Возвращает число строк.
+    """
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet(sheet_name)
+
+    columns = None
+    n = 0
+    for record in records:
+        if columns is None:
+            columns = list(record)
+            ws.append(columns)
+        ws.append([None if _is_missing(record.get(c)) else record.get(c) for c in columns])
+        n += 1
+
+    wb.save(target)
+    return n
+
+
+def _is_missing(v) -> bool:
+    return v is None or (isinstance(v, float) and np.isnan(v))
+
+
 #------------------------------------------------------------------------
 # import re
 # import pandas as pd
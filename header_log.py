@@ -1,8 +1,47 @@
-import io
 from datetime import datetime
 
 import pandas as pd
 
+from workbook import open_workbook
+
+
+# Строку заголовков ищем блоками по HEADER_SCAN_ROWS строк до HEADER_SCAN_LIMIT;
+# дальше — по всему листу (как find_header_row в парсере), одним полным чтением
+HEADER_SCAN_ROWS = 50
+HEADER_SCAN_LIMIT = 500
+HEADER_KEYS = ["division", "group", "class", "subclass"]
+
+
+def _find_header_row(wb, sheet):
+    """
+    Первая строка, где одновременно есть Division, Group, Class, Subclass.
+
+    Строки берутся из общей WorkbookSession (wb.head — без декодирования всего листа)
+    блоками по HEADER_SCAN_ROWS; в каждом блоке строка находится одним векторным isin.
+    Чтение останавливается на первом совпадении или конце листа; после HEADER_SCAN_LIMIT
+    строк без заголовка лист читается целиком (wb.sheet) и поиск идёт по остальным строкам.
+    """
+    nrows = 0
+    while nrows < HEADER_SCAN_LIMIT:
+        start, nrows = nrows, min(nrows + HEADER_SCAN_ROWS, HEADER_SCAN_LIMIT)
+        df = wb.head(sheet, nrows)
+
+        row = _header_in_block(df.iloc[start:])
+        if row is not None or len(df) < nrows:  # нашли или лист кончился
+            return row
+
+    return _header_in_block(wb.sheet(sheet).iloc[HEADER_SCAN_LIMIT:])
+
+
+def _header_in_block(df):
+    if df.empty:
+        return None
+    low = df.astype(str).apply(lambda c: c.str.strip().str.lower())
+    found = low.where(low.isin(HEADER_KEYS)).nunique(axis=1) == len(HEADER_KEYS)
+    if not found.any():
+        return None
+    return df.iloc[found.to_numpy().argmax()]
+
 
 def extract_headers_from_main_table(file_bytes: bytes, sheets=None):
     """
@@ -10,46 +49,23 @@ def extract_headers_from_main_table(file_bytes: bytes, sheets=None):
     Division, Group, Class, Subclass.
 
     Берёт заголовки начиная с 'Division' и далее.
+    Лист целиком не загружается — читаются только строки до заголовка
+    (целиком — только если заголовок ниже HEADER_SCAN_LIMIT); книга — общая с парсером (open_workbook).
     """
-    bio = io.BytesIO(file_bytes)
-    xls = pd.ExcelFile(bio)
+    wb = open_workbook(file_bytes)
 
     if sheets is None:
-        sheets = xls.sheet_names
+        sheets = wb.sheet_names
 
     unique_headers = []
 
     for sheet in sheets:
-        df = pd.read_excel(xls, sheet_name=sheet, header=None)
-
-        header_row_idx = None
-        for i in range(len(df)):
-            row = (
-                df.iloc[i]
-                .astype(str)
-                .str.strip()
-                .str.lower()
-                .tolist()
-            )
-            if (
-                "division" in row
-                and "group" in row
-                and "class" in row
-                and "subclass" in row
-            ):
-                header_row_idx = i
-                break
-
-        if header_row_idx is None:
+        row = _find_header_row(wb, sheet)
+        if row is None:
             continue
 
-        row = df.iloc[header_row_idx].astype(str).str.strip()
-        row_lower = row.str.lower().tolist()
-
-        try:
-            div_pos = row_lower.index("division")
-        except ValueError:
-            continue
+        row_lower = row.astype(str).str.strip().str.lower().tolist()
+        div_pos = row_lower.index("division")
 
         for col in row.iloc[div_pos:]:
             if pd.isna(col):
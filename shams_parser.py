@@ -1,16 +1,38 @@
+import io
+import os
+import tempfile
+import numpy as np
 import pandas as pd
 import re
-import io
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 from typing import List, Tuple
 
+from cache import DiskCache, content_hash
+from workbook import open_workbook, iter_sheet_rows, read_sheet, cell_value, sheet_fingerprints, sheet_names
 from utils import (
     split_en_ar,
     extract_digits,
     is_text_cell,
-    find_first_text_right,
-    normalize_subclass_raw,
+    normalize_subclass_simple,
+    extract_digits_series,
+    normalize_subclass_simple_series,
+    text_cell_matrix,
+    first_text_right,
+    text_fingerprints,
+    FINGERPRINT_COL,
 )
 
+# Версия логики парсинга — входит в ключ дискового кэша; увеличить при изменении результата
+PARSER_VERSION = 5
+
+# Имена шести кадров результата (порядок как в parse_all_sheets_from_bytes)
+FRAME_NAMES = ("full", "sections", "divisions", "groups", "classes", "subclasses")
+
+# Лимит дискового кэша парсинга, МБ (0 — выключить)
+PARSE_CACHE_MB = int(os.environ.get("SHAMS_PARSE_CACHE_MB", "256"))
+_parse_cache = DiskCache("parse", PARSE_CACHE_MB * 1024 * 1024)
+
 # Базовые колонки, которые не считаем "динамическими"
 BASE_COLS = {"part", "section", "division", "group", "class", "subclass", "description", "الوصف"}
 
@@ -74,6 +96,50 @@ def detect_division(text_line: str):
     return None, None, None
 
 
+def detect_banners(df_raw: pd.DataFrame) -> pd.DataFrame:
+    """
+    Находит строки Section / Division.
+
+    Сначала векторно отбираем кандидатов — строки, где первая непустая ячейка
+    начинается с 'section' / 'division'. Склейка строки и detect_section /
+    detect_division выполняются только для них.
+
+    Возвращает DataFrame: kind ('section' | 'division') | code | en | ar | section
+    (section — текущая секция, протянутая вниз через ffill).
+    """
+    columns = ["kind", "code", "en", "ar", "section"]
+    if df_raw.empty:
+        return pd.DataFrame(columns=columns)
+
+    # непустые ячейки: не NaN и не строка из одних пробелов
+    present = df_raw.notna()
+    for c in df_raw.columns:
+        present[c] &= _strip_str(df_raw[c]).ne("")
+    present = present.to_numpy()
+
+    values = df_raw.to_numpy(dtype=object)
+    first = pd.Series(values[np.arange(len(values)), present.argmax(axis=1)])
+    candidates = first.astype(str).str.match(r"\s*(?:section|division)", case=False)
+    candidates &= present.any(axis=1)
+
+    rows = []
+    for pos in np.flatnonzero(candidates.to_numpy()):
+        text_line = " ".join(str(v) for v in values[pos] if pd.notna(v))
+
+        sec_code, sec_en, sec_ar = detect_section(text_line)
+        if sec_code:
+            rows.append(("section", sec_code, sec_en, sec_ar))
+            continue
+
+        div_code, div_en, div_ar = detect_division(text_line)
+        if div_code:
+            rows.append(("division", div_code, div_en, div_ar))
+
+    banners = pd.DataFrame(rows, columns=columns[:-1])
+    banners["section"] = banners["code"].where(banners["kind"] == "section").ffill()
+    return banners
+
+
 def find_header_row(df: pd.DataFrame) -> int:
     header_keywords = {"division", "group", "class", "subclass", "description"}
     for i in range(len(df)):
@@ -83,34 +149,36 @@ def find_header_row(df: pd.DataFrame) -> int:
     raise ValueError("Не найден ряд с заголовками колонок")
 
 
+def _strip_str(col: pd.Series) -> pd.Series:
+    """col.str.strip() для строковых ячеек, остальные → NaN."""
+    try:
+        return col.str.strip()
+    except AttributeError:  # в колонке нет ни одной строки
+        return pd.Series(np.nan, index=col.index, dtype=object)
+
+
+def _text_values(col: pd.Series) -> pd.Series:
+    """Непустые строки колонки (strip), иначе None."""
+    s = _strip_str(col)
+    return s.astype(object).where(s.str.len() > 0, None)
+
+
 def parse_sheet(df_raw: pd.DataFrame):
     sections = {}
     divisions = {}
     division_to_section = {}
-    current_section = None
-
-    # 1) Чтение SECTION / DIVISION текстом
-    for _, row in df_raw.iterrows():
-        text_line = " ".join(str(v) for v in row if pd.notna(v))
 
-        sec_code, sec_en, sec_ar = detect_section(text_line)
-        if sec_code:
-            current_section = sec_code
-            if sec_code not in sections:
-                sections[sec_code] = {
-                    "en": sec_en,
-                    "ar": sec_ar,
-                    "divisions": [],
-                }
+    # 1) Чтение SECTION / DIVISION: только строки-баннеры, секция тянется вперёд (ffill)
+    banners = detect_banners(df_raw)
+    for kind, code, en, ar, current_section in banners.itertuples(index=False):
+        if kind == "section":
+            sections.setdefault(code, {"en": en, "ar": ar, "divisions": []})
             continue
 
-        div_code, div_en, div_ar = detect_division(text_line)
-        if div_code:
-            divisions.setdefault(div_code, {"en": div_en, "ar": div_ar})
-            if current_section:
-                sections[current_section]["divisions"].append(div_code)
-                division_to_section[div_code] = current_section
-            continue
+        divisions.setdefault(code, {"en": en, "ar": ar})
+        if pd.notna(current_section):
+            sections[current_section]["divisions"].append(code)
+            division_to_section[code] = current_section
 
     # 2) Поиск заголовков
     header_row = find_header_row(df_raw)
@@ -140,67 +208,338 @@ def parse_sheet(df_raw: pd.DataFrame):
     classes = {}
     subclasses = {}
 
-    # 3) Чтение Group / Class / Subclass
-    for _, row in df.iterrows():
+    # 3) Чтение Group / Class / Subclass — по колонкам целиком
+    text_mask, text = text_cell_matrix(df)
+    arabic = (
+        _text_values(df.iloc[:, col_ar_descr])
+        if col_ar_descr is not None
+        else pd.Series(None, index=df.index, dtype=object)
+    )
+
+    # GROUP (3 цифры) / CLASS (4 цифры): берём первую встречу кода
+    for col, code_len, target in ((col_group, 3, groups), (col_class, 4, classes)):
+        if col is None:
+            continue
+        codes = extract_digits_series(df[col])
+        codes = codes[codes.str.len() == code_len].drop_duplicates(keep="first")
+        en_values = first_text_right(text_mask, text, codes.index, col)
+        for pos, code, en in zip(codes.index, codes, en_values):
+            target[code] = {"en": en, "ar": arabic[pos]}
+
+    # SUBCLASS
+    if col_subclass is not None:
+        codes = normalize_subclass_simple_series(df[col_subclass]).dropna().drop_duplicates(keep="first")
+        rows = codes.index.to_numpy()
+
+        # значения динамических колонок для выбранных строк
+        # (при повторе имени колонки побеждает последняя — как раньше в dict)
+        dyn_values = {}
+        for name, idx in zip(dynamic_cols, dynamic_col_indices):
+            dyn_values[name] = df.iloc[rows, idx].tolist()
+
+        en_values = first_text_right(text_mask, text, rows, col_subclass)
+        ar_values = arabic.iloc[rows].tolist()
+
+        for i, code in enumerate(codes):
+            subclasses[code] = {
+                "en": en_values[i],
+                "ar": ar_values[i],
+                **{name: vals[i] for name, vals in dyn_values.items()},
+            }
+
+    return sections, divisions, division_to_section, groups, classes, subclasses, dynamic_cols
+
+
+def _cell(values, i):
+    return values[i] if i < len(values) else np.nan
+
+
+def _first_text_right_values(values, start_col):
+    """find_first_text_right для строки-списка."""
+    for v in values[start_col + 1:]:
+        if is_text_cell(v):
+            return str(v).strip()
+    return None
+
+
+def parse_sheet_rows(rows):
+    """
+    Построчный (потоковый) parse_sheet: принимает итератор строк-кортежей
+    и возвращает тот же результат, что parse_sheet для этого листа.
+
+    Отличие только одно: типы колонок не выводятся по всему листу,
+    поэтому чисто числовые динамические колонки могут прийти как int, а не float.
+    """
+    sections = {}
+    divisions = {}
+    division_to_section = {}
+    current_section = None
+
+    header_keywords = {"division", "group", "class", "subclass", "description"}
+    header_found = False
+    col_group = col_class = col_subclass = col_ar_descr = None
+    dynamic_cols = []
+    dynamic_col_indices = []
+
+    groups = {}
+    classes = {}
+    subclasses = {}
+
+    for raw_row in rows:
+        values = [cell_value(v) for v in raw_row]
+
+        # 1) SECTION / DIVISION — только для строк, начинающихся с section/division
+        first = next((v for v in values if pd.notna(v) and str(v).strip()), None)
+        if first is not None and re.match(r"\s*(?:section|division)", str(first), re.I):
+            text_line = " ".join(str(v) for v in values if pd.notna(v))
+
+            sec_code, sec_en, sec_ar = detect_section(text_line)
+            if sec_code:
+                current_section = sec_code
+                sections.setdefault(sec_code, {"en": sec_en, "ar": sec_ar, "divisions": []})
+            else:
+                div_code, div_en, div_ar = detect_division(text_line)
+                if div_code:
+                    divisions.setdefault(div_code, {"en": div_en, "ar": div_ar})
+                    if current_section:
+                        sections[current_section]["divisions"].append(div_code)
+                        division_to_section[div_code] = current_section
+
+        # 2) Строка заголовков (первая, где есть ключевое слово)
+        if not header_found:
+            header = [str(v).strip() for v in values]
+            header_lower = [h.lower() for h in header]
+            if not any(str(v).lower() in header_keywords for v in values):
+                continue
+
+            header_found = True
+            col_group = header_lower.index("group") if "group" in header_lower else None
+            col_class = header_lower.index("class") if "class" in header_lower else None
+            col_subclass = header_lower.index("subclass") if "subclass" in header_lower else None
+            col_ar_descr = next((i for i, nm in enumerate(header_lower) if "الوصف" in nm), None)
+
+            for idx, nm in enumerate(header_lower):
+                if nm not in BASE_COLS and nm not in {"", "unnamed: 0", "nan"}:
+                    dynamic_cols.append(header[idx])
+                    dynamic_col_indices.append(idx)
+            continue
+
+        # 3) Group / Class / Subclass
         arabic_descr = None
         if col_ar_descr is not None:
-            v = row[col_ar_descr]
+            v = _cell(values, col_ar_descr)
             if isinstance(v, str) and v.strip():
                 arabic_descr = v.strip()
 
-        row_dynamic_vals = {
-            dynamic_cols[i]: row[dynamic_col_indices[i]]
-            for i in range(len(dynamic_cols))
-        }
+        for col, code_len, target in ((col_group, 3, groups), (col_class, 4, classes)):
+            if col is None:
+                continue
+            code = extract_digits(_cell(values, col))
+            if code and len(code) == code_len and code not in target:
+                target[code] = {"en": _first_text_right_values(values, col), "ar": arabic_descr}
 
-        # GROUP
-        if col_group is not None:
-            raw = row[col_group]
-            code = extract_digits(raw)
-            if code and len(code) == 3:
-                en = find_first_text_right(row, col_group)
-                groups.setdefault(code, {"en": en, "ar": arabic_descr})
-
-        # CLASS
-        if col_class is not None:
-            raw = row[col_class]
-            code = extract_digits(raw)
-            if code and len(code) == 4:
-                en = find_first_text_right(row, col_class)
-                classes.setdefault(code, {"en": en, "ar": arabic_descr})
-
-        # SUBCLASS
         if col_subclass is not None:
-            raw = row[col_subclass]
-            if pd.notna(raw):
-                code = normalize_subclass_raw(raw)
-                if code:
-                    en = find_first_text_right(row, col_subclass)
-                    subclasses.setdefault(
-                        code,
-                        {
-                            "en": en,
-                            "ar": arabic_descr,
-                            **row_dynamic_vals,
-                        },
-                    )
+            raw = _cell(values, col_subclass)
+            code = normalize_subclass_simple(raw)
+            if code and code not in subclasses:
+                subclasses[code] = {
+                    "en": _first_text_right_values(values, col_subclass),
+                    "ar": arabic_descr,
+                    **{name: _cell(values, idx) for name, idx in zip(dynamic_cols, dynamic_col_indices)},
+                }
+
+    if not header_found:
+        raise ValueError("Не найден ряд с заголовками колонок")
 
     return sections, divisions, division_to_section, groups, classes, subclasses, dynamic_cols
 
 
-def parse_all_sheets_from_bytes(file_bytes, sheets):
-    bio = io.BytesIO(file_bytes)
-    xls = pd.ExcelFile(bio)
+def parse_all_sheets_from_bytes(
+    file_bytes,
+    sheets,
+    workers: int | None = None,
+    use_cache: bool = True,
+    reuse: dict | None = None,
+):
+    """
+    Парсит листы книги и возвращает
+    (df_full, df_sections, df_divisions, df_groups, df_classes, df_subclasses).
+
+    workers > 1 включает параллельный режим: листы читаются и парсятся
+    в ProcessPoolExecutor, результаты сводятся в порядке листов.
+    Для одного листа всегда работаем последовательно.
+
+    reuse — {отпечаток листа: результат parse_sheet} (например, Baseline.sheets):
+    листы с совпавшим отпечатком не декодируются, берётся готовый результат.
+
+    Результат кэшируется на диске по SHA-256 байтов файла + список листов + PARSER_VERSION.
+    """
+    frames, _ = _parse_cached(file_bytes, sheets, workers, use_cache, reuse, with_sheets=False)
+    return frames
+
+
+def parse_workbook(
+    file_bytes,
+    sheets=None,
+    workers: int | None = None,
+    use_cache: bool = True,
+    reuse: dict | None = None,
+) -> tuple:
+    """
+    (шесть кадров parse_all_sheets_from_bytes, [(отпечаток листа, результат parse_sheet)]).
+    Тот же дисковый кэш: результаты по листам лежат в записи рядом с кадрами,
+    поэтому базовый файл и снимки тоже не парсятся повторно.
+    """
+    return _parse_cached(file_bytes, sheets, workers, use_cache, reuse, with_sheets=True)
+
+
+def _parse_cached(file_bytes, sheets, workers, use_cache, reuse, with_sheets: bool) -> tuple:
+    key = content_hash(file_bytes, list(sheets or []), PARSER_VERSION)
+
+    if use_cache:
+        hit = _parse_cache.get(key, names=None if with_sheets else FRAME_NAMES)
+        if hit is not None:
+            frames, meta = hit
+            result = tuple(frames[name] for name in FRAME_NAMES)
+            if not with_sheets:
+                return result, None
+            try:
+                return result, sheet_results_from_frames(frames, meta["sheets"])
+            except (KeyError, TypeError):  # запись без листов — парсим заново
+                pass
 
+    results = parse_sheet_results(file_bytes, sheets, workers, reuse)
+    result = build_frames(r for _, r in results)
+
+    if use_cache:
+        frames, sheets_meta = sheet_results_to_frames(results)
+        _parse_cache.put(key, {**dict(zip(FRAME_NAMES, result)), **frames}, {"sheets": sheets_meta})
+
+    return result, results
+
+
+def sheet_results_to_frames(results) -> tuple:
+    """
+    [(отпечаток, результат parse_sheet)] → ({имя кадра: DataFrame}, [метаданные листов]) для
+    хранения без pickle: на лист два кадра — уровни (Section/Division/Group/Class)
+    и Subclass с динамическими колонками (колонки d0, d1, ... — имена в метаданных).
+    """
+    frames, meta = {}, []
+    for i, (fp, (s, d, m, g, c, sc, dyn)) in enumerate(results):
+        levels = (
+            [("section", code, v["en"], v["ar"], None, list(v["divisions"])) for code, v in s.items()]
+            + [("division", code, v["en"], v["ar"], m.get(code), None) for code, v in d.items()]
+            + [("group", code, v["en"], v["ar"], None, None) for code, v in g.items()]
+            + [("class", code, v["en"], v["ar"], None, None) for code, v in c.items()]
+        )
+        names = list(dict.fromkeys(dyn))  # в записи Subclass повтор имени колонки — один ключ
+        subclasses = [
+            (code, v["en"], v["ar"], *(v.get(name) for name in names))
+            for code, v in sc.items()
+        ]
+        dyn_cols = [f"d{j}" for j in range(len(names))]
+
+        frames[f"sheet{i}_levels"] = pd.DataFrame(
+            levels, columns=["level", "code", "en", "ar", "parent", "divisions"]
+        )
+        frames[f"sheet{i}_subclasses"] = pd.DataFrame(subclasses, columns=["code", "en", "ar", *dyn_cols])
+        meta.append({"fingerprint": fp, "dynamic_cols": list(dyn), "names": names})
+    return frames, meta
+
+
+def sheet_results_from_frames(frames: dict, meta: list) -> list:
+    """Обратно к [(отпечаток, результат parse_sheet)] — вход build_frames и reuse."""
+    results = []
+    for i, info in enumerate(meta):
+        s, d, m, g, c, sc = {}, {}, {}, {}, {}, {}
+        levels = frames[f"sheet{i}_levels"]
+        for level, code, en, ar, parent, divisions in levels.itertuples(index=False):
+            if level == "section":
+                s[code] = {"en": en, "ar": ar, "divisions": list(divisions)}
+            elif level == "division":
+                d[code] = {"en": en, "ar": ar}
+                if parent is not None:
+                    m[code] = parent
+            else:
+                (g if level == "group" else c)[code] = {"en": en, "ar": ar}
+
+        subclasses = frames[f"sheet{i}_subclasses"]
+        names = info["names"]
+        for code, en, ar, *values in subclasses.itertuples(index=False):
+            sc[code] = {"en": en, "ar": ar, **dict(zip(names, values))}
+
+        results.append((info["fingerprint"], (s, d, m, g, c, sc, list(info["dynamic_cols"]))))
+    return results
+
+
+def parse_sheet_results(file_bytes, sheets=None, workers: int | None = None, reuse: dict | None = None) -> list:
+    """
+    [(отпечаток листа, результат parse_sheet)] в порядке листов — вход для build_frames.
+    Отпечаток — из workbook.sheet_fingerprints (None, если посчитать не удалось).
+    """
+    names = sheet_names(file_bytes)
     if not sheets:
-        sheets = xls.sheet_names
+        sheets = names
+
+    fingerprints = sheet_fingerprints(file_bytes)
+    fps = [fingerprints.get(names[s] if isinstance(s, int) else s) for s in sheets]
+    results = [reuse.get(fp) if reuse and fp else None for fp in fps]
+
+    # парсим только листы, которых нет в reuse
+    todo = [sheet for sheet, r in zip(sheets, results) if r is None]
+
+    if workers and workers > 1 and len(todo) > 1:
+        parsed = iter(_parse_sheets_parallel(file_bytes, todo, workers))
+    else:
+        # книгу открываем только здесь: параллельный режим читает листы в воркерах
+        wb = open_workbook(file_bytes) if todo else None
+        parsed = (parse_sheet(wb.sheet(sheet)) for sheet in todo)
+
+    results = [r if r is not None else next(parsed) for r in results]
+    return list(zip(fps, results))
+
 
+def _parse_sheets_parallel(file_bytes, sheets, workers: int) -> list:
+    """
+    Листы в ProcessPoolExecutor. Байты пишутся во временный файл один раз,
+    воркер получает только путь и имя листа и декодирует только свой лист.
+    """
+    fd, path = tempfile.mkstemp(suffix=".xlsx")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(file_bytes)
+        with ProcessPoolExecutor(max_workers=min(workers, len(sheets))) as pool:
+            return list(pool.map(_parse_sheet_from_path, repeat(path), sheets))
+    finally:
+        os.remove(path)
+
+
+def _parse_sheet_from_path(path, sheet):
+    """Задача для процесса-воркера: прочитать и распарсить один лист."""
+    return parse_sheet(read_sheet(path, sheet, header=None))
+
+
+def parse_all_sheets_streaming(file_bytes, sheets):
+    """
+    Потоковый вариант parse_all_sheets_from_bytes для очень больших файлов.
+
+    Листы читаются openpyxl в режиме read_only построчно (iter_rows(values_only=True)),
+    сетка ячеек целиком в памяти не держится — только то, что попадает в результат.
+    Возвращает те же шесть DataFrame.
+    """
+    rows_by_sheet = iter_sheet_rows(file_bytes, sheets or None, engine="openpyxl")
+    return build_frames(parse_sheet_rows(rows) for _, rows in rows_by_sheet)
+
+
+def build_frames(sheet_results):
+    """
+    Сводит результаты parse_sheet / parse_sheet_rows по листам (в порядке листов)
+    в DataFrame уровней и полную иерархию.
+    """
     S, D, MAP, G, C, SC = {}, {}, {}, {}, {}, {}
-    dynamic_cols_all = set()
+    dynamic_cols_all = {}  # dict вместо set — порядок колонок не зависит от хеширования
 
-    for sheet in sheets:
-        df_raw = pd.read_excel(xls, sheet_name=sheet, header=None)
-        s, d, m, g, c, sc, dyn = parse_sheet(df_raw)
+    for s, d, m, g, c, sc, dyn in sheet_results:
 
         for sec, data in s.items():
             if sec not in S:
@@ -216,9 +555,11 @@ def parse_all_sheets_from_bytes(file_bytes, sheets):
         SC.update(sc)
 
         for col in dyn:
-            dynamic_cols_all.add(col)
+            dynamic_cols_all.setdefault(col, None)
 
     dynamic_cols = list(dynamic_cols_all)
+    if FINGERPRINT_COL in dynamic_cols_all:
+        raise ValueError(f"Колонка «{FINGERPRINT_COL}» зарезервирована для отпечатка описания — переименуйте её в файле")
 
     # ====== Датафреймы уровней ======
     df_sections = pd.DataFrame([
@@ -272,7 +613,9 @@ def parse_all_sheets_from_bytes(file_bytes, sheets):
         "Subclass", "Subclass_en", "Subclass_ar",
     ]
 
+    # отпечаток описания считается один раз при парсинге и хранится вместе с кадром (кэш, снимки)
     df_full = df_full[static_cols + dynamic_cols]
+    df_full = df_full.assign(**{FINGERPRINT_COL: text_fingerprints(df_full["Subclass_en"])})
 
     return df_full, df_sections, df_divisions, df_groups, df_classes, df_subclasses
 
@@ -292,7 +635,7 @@ def make_processed_excel_bytes(df_full, df_sections, df_divisions, df_groups, df
     buffer = io.BytesIO()
 
     with pd.ExcelWriter(buffer, engine="openpyxl") as writer:
-        df_full.to_excel(writer, index=False, sheet_name="full")
+        df_full.drop(columns=FINGERPRINT_COL, errors="ignore").to_excel(writer, index=False, sheet_name="full")
         df_sections[["Section", "Section_en", "Section_ar"]].to_excel(writer, index=False, sheet_name="sections")
         df_divisions[["Division", "Division_en", "Division_ar"]].to_excel(writer, index=False, sheet_name="divisions")
         df_groups[["Group", "Group_en", "Group_ar"]].to_excel(writer, index=False, sheet_name="groups")
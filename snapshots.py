@@ -0,0 +1,162 @@
+import json
+import os
+import shutil
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+import pandas as pd
+
+from cache import BASE_DIR, read_frame, write_frame
+from shams_parser import FRAME_NAMES, PARSER_VERSION, sheet_results_from_frames, sheet_results_to_frames
+
+# Снимки распарсенных каталогов провайдера: последний снимок — "старая" сторона сравнения
+SNAPSHOT_DIR = Path(os.environ.get("SHAMS_SNAPSHOT_DIR", BASE_DIR / "snapshots"))
+SNAPSHOTS_ENABLED = os.environ.get("SHAMS_SNAPSHOTS", "1") != "0"
+
+# Сколько последних снимков хранить (старые удаляются при записи нового)
+SNAPSHOT_KEEP = int(os.environ.get("SHAMS_SNAPSHOT_KEEP", "20"))
+
+
+class Snapshot:
+    """
+    Снимок на диске: SNAPSHOT_DIR/<время>-<хеш>/.
+
+    Внутри — шесть кадров parse_all_sheets_from_bytes (FRAME_NAMES), кадр "normalized"
+    (нормализованные для сравнения текстовые колонки df_full), результаты parse_sheet
+    по листам (кадры sheet<i>_*, см. shams_parser.sheet_results_to_frames) и meta.json:
+    source_hash, created, provider, headers, fingerprints, sheets, parser_version.
+    Кадры — Parquet (pyarrow) или pickle (cache.write_frame).
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.meta = json.loads((self.path / "meta.json").read_text("utf-8"))
+
+    @property
+    def source_hash(self) -> str:
+        return self.meta["source_hash"]
+
+    @property
+    def created(self) -> float:
+        return self.meta["created"]
+
+    def frames(self) -> tuple:
+        return tuple(read_frame(self.path / name) for name in FRAME_NAMES)
+
+    def normalized(self) -> pd.DataFrame:
+        return read_frame(self.path / "normalized")
+
+    def sheets(self) -> dict:
+        """Результаты parse_sheet по отпечаткам листов ({} — если не сохранялись)."""
+        try:
+            sheets_meta = self.meta.get("sheets") or []
+            frames = {
+                name: read_frame(self.path / name)
+                for i in range(len(sheets_meta))
+                for name in (f"sheet{i}_levels", f"sheet{i}_subclasses")
+            }
+            return {fp: r for fp, r in sheet_results_from_frames(frames, sheets_meta) if fp}
+        except Exception:  # не сохранялись / повреждены — просто без переиспользования листов
+            return {}
+
+
+def _snapshot_dirs() -> list:
+    """Готовые снимки (по имени = по времени создания, от старых к новым)."""
+    try:
+        entries = sorted(
+            entry for entry in SNAPSHOT_DIR.iterdir()
+            if not entry.name.startswith(".") and (entry / "meta.json").exists()
+        )
+    except OSError:
+        return []
+    return entries
+
+
+def latest_snapshot() -> Snapshot | None:
+    """Последний снимок текущей версии парсера или None."""
+    for path in reversed(_snapshot_dirs()):
+        try:
+            snapshot = Snapshot(path)
+        except (OSError, ValueError):  # удалён параллельно / битый meta.json
+            continue
+        if snapshot.meta.get("parser_version") == PARSER_VERSION:
+            return snapshot
+    return None
+
+
+def find_snapshot(source_hash: str) -> Snapshot | None:
+    for path in reversed(_snapshot_dirs()):
+        if path.name.endswith(f"-{source_hash[:16]}"):
+            try:
+                snapshot = Snapshot(path)
+            except (OSError, ValueError):
+                continue
+            if snapshot.source_hash == source_hash and snapshot.meta.get("parser_version") == PARSER_VERSION:
+                return snapshot
+    return None
+
+
+def save_snapshot(
+    source_hash: str,
+    frames: tuple,
+    normalized: pd.DataFrame,
+    headers: list,
+    fingerprints: dict,
+    provider: str | None = None,
+    sheets: dict | None = None,
+) -> Snapshot | None:
+    """
+    Записывает снимок (атомарно: временный каталог → os.replace) и возвращает его.
+    Снимок того же файла уже есть — возвращается он; ошибка записи — None (снимки не критичны).
+    sheets — {отпечаток листа: результат parse_sheet}, как Baseline.sheets.
+    """
+    if not SNAPSHOTS_ENABLED:
+        return None
+
+    existing = find_snapshot(source_hash)
+    if existing is not None:
+        return existing
+
+    created = time.time()
+    name = f"{datetime.fromtimestamp(created):%Y%m%dT%H%M%S%f}-{source_hash[:16]}"
+
+    try:
+        SNAPSHOT_DIR.mkdir(parents=True, exist_ok=True)
+        tmp = Path(tempfile.mkdtemp(dir=SNAPSHOT_DIR, prefix=".tmp-"))
+    except OSError:
+        return None
+
+    try:
+        for frame_name, df in zip(FRAME_NAMES, frames):
+            write_frame(df, tmp / frame_name)
+        write_frame(normalized, tmp / "normalized")
+        sheet_frames, sheets_meta = sheet_results_to_frames(list((sheets or {}).items()))
+        for frame_name, df in sheet_frames.items():
+            write_frame(df, tmp / frame_name)
+
+        meta = {
+            "source_hash": source_hash,
+            "created": created,
+            "provider": provider,
+            "headers": list(headers),
+            "fingerprints": dict(fingerprints),
+            "sheets": sheets_meta,
+            "parser_version": PARSER_VERSION,
+        }
+        (tmp / "meta.json").write_text(json.dumps(meta, ensure_ascii=False, default=str), "utf-8")
+
+        os.replace(tmp, SNAPSHOT_DIR / name)
+    except OSError:
+        return None
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    _prune()
+    return Snapshot(SNAPSHOT_DIR / name)
+
+
+def _prune():
+    for path in _snapshot_dirs()[:-SNAPSHOT_KEEP] if SNAPSHOT_KEEP > 0 else []:
+        shutil.rmtree(path, ignore_errors=True)
@@ -0,0 +1,135 @@
+import random
+import sys
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+# модули приложения лежат в корне репозитория (без пакета)
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+# Seeded random входы для тестов "батч / потоковая версия == эталон":
+# тест берёт фикстуру rnd (или фабрику поверх неё) и прогоняется на каждом seed.
+# Один конкретный seed — @pytest.mark.parametrize("seed", [0]) в самом тесте.
+SEEDS = range(20)
+
+
+@pytest.fixture(params=SEEDS)
+def seed(request) -> int:
+    return request.param
+
+
+@pytest.fixture
+def rnd(seed) -> random.Random:
+    return random.Random(seed)
+
+
+# ---------- значения ячеек для нормализаторов utils ----------
+
+_WORDS = [
+    "Retail", "sale", "of", "Printing", "e-commerce", "ÉTÉ", "ﬁle", "Ⅻ",
+    "بيع", "التجزئة", "الوصف", "طباعة", "١٢٣", "٤٣٢١٫٠٢", "Section", "G:",
+]
+_SPACES = [" ", "  ", "\t", "\n", " ", "\r\n", ""]
+
+
+def _text(rnd: random.Random) -> str:
+    words = rnd.choices(_WORDS, k=rnd.randint(1, 5))
+    gaps = rnd.choices(_SPACES, k=len(words) + 1)
+    return "".join(g + w for g, w in zip(gaps, words)) + gaps[-1]
+
+
+def _code(rnd: random.Random):
+    main = rnd.randint(0, 9999)
+    return rnd.choice([
+        f"{main:04d}.{rnd.randint(0, 99):02d}",
+        f"{main:04d},{rnd.randint(0, 99)}",
+        main + rnd.randint(0, 99) / 100,
+        f"{main}.{rnd.randint(0, 10 ** 9)}",  # длинный хвост
+        9000.149999999,
+        9999.995,
+        main * 100 + rnd.randint(0, 99),
+        f" {main:04d}.{rnd.randint(0, 9)} ",
+        str(rnd.randint(0, 9999)),  # меньше 5 цифр — не код
+    ])
+
+
+def _value(rnd: random.Random):
+    kind = rnd.random()
+    if kind < 0.1:
+        return np.nan
+    if kind < 0.15:
+        return None
+    if kind < 0.2:
+        return ""
+    if kind < 0.25:
+        return rnd.choice(_SPACES)
+    if kind < 0.35:
+        return rnd.choice([1234.5, 0.0, -7.25, 1e20, rnd.uniform(-1e6, 1e6)])
+    if kind < 0.4:
+        return rnd.randint(-10 ** 6, 10 ** 6)
+    if kind < 0.6:
+        return _code(rnd)
+    return _text(rnd)
+
+
+@pytest.fixture
+def random_values(rnd):
+    """
+    size → object Series: NaN/None, float (1234.5, 9000.149999999), коды в разном виде,
+    арабский/латинский текст со смешанными пробелами, пустые строки.
+    """
+    def make(size: int) -> pd.Series:
+        return pd.Series([_value(rnd) for _ in range(size)], dtype=object)
+
+    return make
+
+
+# ---------- текстовые df_full для сравнения ----------
+
+FRAME_COLUMNS = ["Subclass", "Subclass_en", "A", "A", "B", "C"]
+_FRAME_WORDS = ["Retail", "sale", "of", "goods", "بيع", "التجزئة", "Printing", " ", ""]
+
+
+def _cell(rnd: random.Random):
+    kind = rnd.random()
+    if kind < 0.15:
+        return None
+    if kind < 0.2:
+        return np.nan
+    return " ".join(rnd.choices(_FRAME_WORDS, k=rnd.randint(1, 3)))
+
+
+def _frame_code(rnd: random.Random) -> str:
+    main, frac = rnd.randint(1000, 1010), rnd.randint(0, 9)
+    # один и тот же ключ в разном виде: 1001.05 / 1001.050 / 100105
+    return rnd.choice([f"{main}.{frac:02d}", f"{main}.{frac:02d}0", f"{main}{frac:02d}"])
+
+
+@pytest.fixture
+def random_frame(rnd):
+    """
+    size → df_full с колонками FRAME_COLUMNS: повторяющиеся ключи в разном виде,
+    повтор имени колонки (A), текст с пропусками (None / NaN).
+    """
+    def make(size: int) -> pd.DataFrame:
+        rows = [[_frame_code(rnd)] + [_cell(rnd) for _ in FRAME_COLUMNS[1:]] for _ in range(size)]
+        return pd.DataFrame(rows, columns=FRAME_COLUMNS)
+
+    return make
+
+
+@pytest.fixture
+def changed_copy(rnd, random_frame):
+    """df → новая сторона: часть строк удалена, часть ячеек изменена, добавлены новые строки."""
+    def make(df: pd.DataFrame) -> pd.DataFrame:
+        rows = [list(r) for r in df.itertuples(index=False) if rnd.random() > 0.1]
+        for row in rows:
+            for i in range(1, len(row)):
+                if rnd.random() < 0.1:
+                    row[i] = _cell(rnd)
+        added = random_frame(len(df) // 5).values.tolist()
+        return pd.DataFrame(rows + added, columns=df.columns)
+
+    return make
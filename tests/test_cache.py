@@ -0,0 +1,55 @@
+"""
+write_frame → read_frame возвращает тот же кадр: смешанные object-колонки (числа и текст,
+NaN и None) сохраняют тип каждого значения, списки строк остаются списками.
+sidecar_frame: файл-спутник у каждого источника свой, в том числе при точках в имени.
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+import cache
+from cache import HAS_PYARROW, read_frame, sidecar_frame, write_frame
+
+
+def _frame() -> pd.DataFrame:
+    return pd.DataFrame({
+        "mixed": [1.5, "5a", None, np.nan, 3, True, 0.1 + 0.2],
+        "text": ["a", None, np.nan, "b", "", "c", "d"],
+        "lists": [["x"], None, ["y", "z"], [], None, ["w"], ["v"]],
+        "number": [1.0, 2.0, np.nan, 4.0, 5.0, 6.0, 7.0],
+    })
+
+
+def test_round_trip_keeps_values_and_types(tmp_path):
+    df = _frame()
+    out = write_frame(df, tmp_path / "frame")
+    assert out.suffix == (".parquet" if HAS_PYARROW else ".pkl")
+
+    back = read_frame(tmp_path / "frame")
+    pd.testing.assert_frame_equal(back, df)
+    assert [type(v) for v in back["mixed"]] == [type(v) for v in df["mixed"]]
+    assert back["text"][1] is None and back["text"][2] is not None
+
+
+@pytest.mark.skipif(not HAS_PYARROW, reason="нужен pyarrow")
+def test_unsupported_values_fall_back_to_pickle(tmp_path):
+    df = pd.DataFrame({"mixed": ["a", pd.Timestamp("2024-01-01")]})
+    assert write_frame(df, tmp_path / "frame").suffix == ".pkl"
+    pd.testing.assert_frame_equal(read_frame(tmp_path / "frame"), df)
+
+
+def test_sidecar_per_source_with_dotted_names(tmp_path, monkeypatch):
+    monkeypatch.setattr(cache, "CACHE_DIR", tmp_path / "cache")
+    built = []
+
+    def build(name):
+        built.append(name)
+        return pd.DataFrame({"name": [name]})
+
+    for name in ["db.v2.xlsx", "db.v3.xlsx", "db.v2.xlsx", "db.v3.xlsx"]:
+        source = tmp_path / name
+        if not source.exists():
+            source.write_text(name)
+        assert sidecar_frame(source, lambda: build(name))["name"].tolist() == [name]
+
+    assert built == ["db.v2.xlsx", "db.v3.xlsx"]  # второй раз — из спутника
@@ -0,0 +1,90 @@
+"""
+compare_streaming(keyed_records(old), keyed_records(new), ...) должен давать то же,
+что compare_shams(old, new, ...): те же колонки, строки и значения. Входы — seeded random
+текстовые df_full (фикстуры random_frame / changed_copy, conftest) и пустые стороны.
+Числа не берём: после outer merge compare_shams превращает их во float ("5.0"),
+потоковая версия — нет (известное отличие).
+"""
+import pandas as pd
+import pytest
+
+from compare import compare_sharded, compare_shams, compare_streaming, comparison_stats, keyed_records
+
+SIZE = 60
+
+MAPPINGS = [
+    ({}, None),
+    ({"A": "A", "B": None, "C": None}, ["A"]),
+    ({"Subclass_en": "Subclass_en", "A": "A", " c ": None, "Нет такой": None}, ["Subclass_en", "A"]),
+    ({"B": "A", "C": "C", "A": None}, ["B", "C"]),
+]
+
+
+def _streamed(old, new, mapping, compare_cols) -> list:
+    return list(compare_streaming(keyed_records(old), keyed_records(new), mapping, compare_cols))
+
+
+def _assert_same(old, new, mapping, compare_cols):
+    expected = compare_shams(old, new, mapping, compare_cols)
+    records = _streamed(old, new, mapping, compare_cols)
+
+    if expected.empty:
+        assert records == []
+        return
+    assert all(list(r) == list(expected.columns) for r in records)
+
+    actual = pd.DataFrame(records, columns=expected.columns).astype(object)
+    expected = expected.astype(object)
+    # пропуски (None / NaN) в обеих версиях считаем одинаковыми
+    assert actual.where(actual.notna(), None).values.tolist() == expected.where(expected.notna(), None).values.tolist()
+
+
+@pytest.mark.parametrize("mapping, compare_cols", MAPPINGS)
+def test_streaming_matches_compare_shams(random_frame, changed_copy, mapping, compare_cols):
+    old = random_frame(SIZE)
+    _assert_same(old, changed_copy(old), mapping, compare_cols)
+
+
+@pytest.mark.parametrize("seed", [0])
+@pytest.mark.parametrize("mapping, compare_cols", MAPPINGS)
+def test_streaming_empty_sides(random_frame, mapping, compare_cols):
+    df = random_frame(SIZE)
+    empty = df.iloc[:0]
+    _assert_same(df, empty, mapping, compare_cols)
+    _assert_same(empty, df, mapping, compare_cols)
+    _assert_same(empty, empty, mapping, compare_cols)
+
+
+@pytest.mark.parametrize("seed", [1])
+def test_new_only_columns_with_empty_new_side(random_frame):
+    old = random_frame(5)
+    records = _streamed(old, old.iloc[:0], {"B": None}, None)
+    assert records and all("B" in r and pd.isna(r["B"]) for r in records)
+
+
+def test_duplicate_columns_take_first_non_null():
+    df = pd.DataFrame([["1000.01", "x", None, "second"]], columns=["Subclass", "Subclass_en", "A", "A"])
+    (_, record), = keyed_records(df)
+    assert record["A"] == "second"
+    assert keyed_records(df).columns == ["Subclass", "Subclass_en", "A"]
+
+
+# ключи на границах Division (1999.99 | 2000.00, 0999.99 | 1000.00) и Division только с одной стороны
+BOUNDARY_OLD = ["1999.99", "2000.00", "2000.01", "0999.99", "1000.00", "0101.01", "9999.99"]
+BOUNDARY_NEW = ["199999", "2000.000", "2000.02", "0999.99", "1000.00", "0101.01", "3000.01"]
+
+
+@pytest.mark.parametrize("seed", [0])
+@pytest.mark.parametrize("workers", [1, 2])
+@pytest.mark.parametrize("mapping, compare_cols", MAPPINGS)
+def test_sharded_matches_compare_shams(random_frame, workers, mapping, compare_cols):
+    old = random_frame(len(BOUNDARY_OLD)).assign(Subclass=BOUNDARY_OLD)
+    new = old.assign(Subclass=BOUNDARY_NEW)
+    new.iloc[1:3, 1:] = random_frame(2).iloc[:, 1:].to_numpy()  # изменённые строки у границы
+
+    expected = compare_shams(old, new, mapping, compare_cols)
+    actual, stats = compare_sharded(old, new, mapping, compare_cols, workers=workers)
+    assert actual.dtypes.equals(expected.dtypes)
+    # пропуски новых колонок у удалённых строк merge заполняет по-разному в разных шардах (None / NaN)
+    pd.testing.assert_frame_equal(actual.where(actual.notna(), None), expected.where(expected.notna(), None))
+    pd.testing.assert_frame_equal(stats, comparison_stats(expected))
@@ -0,0 +1,75 @@
+"""
+Повторяющиеся Subclass_code (1000.01 / 1000.010 / 100001 — один ключ): политика duplicates
+("first" / "last" / "error") решает, какая строка сравнивается; отброшенные и оставленные
+строки — в result.attrs["duplicates"]. Без повторов политика на результат не влияет.
+"""
+import pandas as pd
+import pytest
+
+from compare import DUPLICATE_POLICIES, compare_shams, compare_streaming, keyed_records
+
+MAPPING = {"B": None}  # B — новая колонка: в результате видно, какая строка new осталась
+
+OLD = pd.DataFrame({"Subclass": ["1000.01", "1000.010", "1000.02"], "Subclass_en": ["one", "uno", "two"]})
+NEW = pd.DataFrame({
+    "Subclass": ["1000.01", "1000.02", "100002"],
+    "Subclass_en": ["one", "two", "deux"],
+    "B": ["b1", "first", "last"],
+})
+
+EXPECTED = {
+    "first": [
+        ["1000.01", "not changed", "", "b1"],
+        ["1000.02", "not changed", "", "first"],
+    ],
+    "last": [
+        ["1000.01", "changed", "OLD: uno\nNEW: one", "b1"],
+        ["1000.02", "changed", "OLD: two\nNEW: deux", "last"],
+    ],
+}
+
+
+def _rows(df: pd.DataFrame) -> list:
+    return df.astype(object).where(df.notna(), "").values.tolist()
+
+
+@pytest.mark.parametrize("policy", ["first", "last"])
+def test_policy_keeps_expected_row(policy):
+    result = compare_shams(OLD, NEW, MAPPING, duplicates=policy)
+    assert _rows(result) == EXPECTED[policy]
+
+
+@pytest.mark.parametrize("policy", ["first", "last"])
+def test_duplicates_report(policy):
+    report = compare_shams(OLD, NEW, MAPPING, duplicates=policy).attrs["duplicates"]
+    first = policy == "first"
+    assert report.values.tolist() == [
+        ["old", "1000.01", "1000.01", first],
+        ["old", "1000.01", "1000.010", not first],
+        ["new", "1000.02", "1000.02", first],
+        ["new", "1000.02", "100002", not first],
+    ]
+
+
+@pytest.mark.parametrize("old, new", [(OLD, NEW.iloc[:2]), (OLD.iloc[[0, 2]], NEW)])
+def test_error_raises(old, new):
+    with pytest.raises(ValueError, match="Повторяющиеся Subclass_code"):
+        compare_shams(old, new, MAPPING, duplicates="error")
+
+
+def test_unknown_policy_raises():
+    with pytest.raises(ValueError, match="Неизвестная политика дублей"):
+        compare_shams(OLD, NEW, MAPPING, duplicates="random")
+
+
+@pytest.mark.parametrize("policy", DUPLICATE_POLICIES)
+def test_no_duplicates_same_result(policy):
+    result = compare_shams(OLD.iloc[[0, 2]], NEW.iloc[:2], MAPPING, duplicates=policy)
+    assert _rows(result) == EXPECTED["first"]
+    assert "duplicates" not in result.attrs
+
+
+@pytest.mark.parametrize("policy", ["first", "last"])
+def test_streaming_keeps_same_row(policy):
+    records = compare_streaming(keyed_records(OLD), keyed_records(NEW), MAPPING, duplicates=policy)
+    assert _rows(pd.DataFrame(list(records))) == EXPECTED[policy]
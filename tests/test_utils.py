@@ -0,0 +1,76 @@
+"""
+Батч-версии нормализаторов utils (*_series) должны давать ровно то же,
+что Series.map(скалярная версия). Входы — seeded random (фикстура random_values, conftest).
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from utils import (
+    extract_digits,
+    extract_digits_series,
+    format_subclass_key,
+    format_subclass_key_series,
+    normalize_subclass_simple,
+    normalize_subclass_simple_series,
+    normalize_text_for_compare,
+    normalize_text_for_compare_series,
+    split_en_ar,
+    split_en_ar_series,
+    subclass_key,
+    subclass_key_series,
+)
+
+SIZE = 300
+
+
+def _assert_same(batched: pd.Series, values: pd.Series, scalar):
+    expected = values.map(scalar, na_action=None)
+    # nullable-типы (<NA>) сравниваем с None скалярной версии
+    actual = batched.astype(object).where(batched.notna(), None)
+    expected = expected.astype(object).where(expected.notna(), None)
+    assert actual.index.equals(values.index)
+    assert actual.tolist() == expected.tolist()
+
+
+def test_split_en_ar_series(random_values):
+    values = random_values(SIZE)
+    batched = split_en_ar_series(values)
+    _assert_same(batched["en"], values, lambda v: split_en_ar(v)[0])
+    _assert_same(batched["ar"], values, lambda v: split_en_ar(v)[1])
+
+
+def test_extract_digits_series(random_values):
+    values = random_values(SIZE)
+    _assert_same(extract_digits_series(values), values, extract_digits)
+
+
+def test_subclass_key_series(random_values):
+    values = random_values(SIZE)
+    _assert_same(subclass_key_series(values), values, subclass_key)
+
+
+def test_format_subclass_key_series(rnd):
+    keys = pd.Series(
+        [rnd.choice([None, np.nan, rnd.randint(0, 1_000_000)]) for _ in range(SIZE)],
+        dtype=object,
+    )
+    _assert_same(format_subclass_key_series(keys), keys, format_subclass_key)
+
+
+def test_normalize_subclass_simple_series(random_values):
+    values = random_values(SIZE)
+    _assert_same(normalize_subclass_simple_series(values), values, normalize_subclass_simple)
+
+
+def test_normalize_text_for_compare_series(random_values):
+    values = random_values(SIZE)
+    _assert_same(normalize_text_for_compare_series(values), values, normalize_text_for_compare)
+
+
+@pytest.mark.parametrize("seed", [0])
+def test_series_accept_ndarray(random_values):
+    values = random_values(SIZE)
+    array = values.to_numpy()
+    assert normalize_text_for_compare_series(array).tolist() == normalize_text_for_compare_series(values).tolist()
+    assert subclass_key_series(array).tolist() == subclass_key_series(values).tolist()
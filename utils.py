@@ -1,7 +1,17 @@
 import re
+import numpy as np
 import pandas as pd
-import math
 import unicodedata
+from functools import lru_cache
+
+# Сколько различных строк помнит кэш normalize_text_for_compare (между вызовами)
+NORMALIZE_CACHE_SIZE = 65536
+
+# Служебная колонка df_full с отпечатком описания (Subclass_en): shams_parser.build_frames → CompareSession.
+# Имя зарезервировано — колонка поставщика с таким именем — ошибка (build_frames)
+FINGERPRINT_COL = "__fp_subclass_en"
+
+_RE_NON_DIGIT = re.compile(r"[^\d]")
 
 
 def split_en_ar(text):
@@ -46,39 +56,34 @@ def find_first_text_right(row, start_col):
     return None
 
 
-def normalize_subclass_raw(val):
+def text_cell_matrix(df: pd.DataFrame):
     """
-    Приводит сырое значение Subclass к формату NNNN.NN
-    с учётом возможных дробей и хвостов.
+    Векторный is_text_cell для всего листа сразу.
 
-    Примеры:
-      4321.02         -> 4321.02
-      9000,149999999  -> 9000.15
-      1572.1          -> 1572.10
+    Возвращает (mask, text):
+      mask — bool-матрица "ячейка текстовая"
+      text — матрица str(v).strip() (значима только там, где mask)
     """
-    if val is None or pd.isna(val):
-        return None
-
-    s = str(val).strip().replace(",", ".")
-    digits = re.sub(r"[^\d]", "", s)
-    if len(digits) < 5:
-        return None  # слишком коротко, это не Subclass
+    text = df.astype(object).apply(lambda c: c.astype(str).str.strip())
+    numeric = text.apply(lambda c: c.str.replace(".", "", regex=False).str.isdigit())
+    mask = df.notna() & text.ne("") & ~numeric.astype(bool)
+    return mask.to_numpy(dtype=bool), text.to_numpy(dtype=object)
 
-    main = digits[:4]
-    frac_raw = digits[4:]
 
-    if len(frac_raw) <= 2:
-        frac = frac_raw.ljust(2, "0")
-    else:
-        scale = 10 ** (len(frac_raw) - 2)
-        frac_int = math.ceil(int(frac_raw) / scale)
-        if frac_int == 100:
-            main_int = int(main) + 1
-            main = f"{main_int:04d}"
-            frac_int = 0
-        frac = f"{frac_int:02d}"
+def first_text_right(text_mask, text, rows, start_col):
+    """
+    Массивный find_first_text_right: для каждой строки из rows —
+    первое текстовое значение справа от start_col (или None).
+    """
+    rows = np.asarray(rows, dtype=int)
+    block = text_mask[rows, start_col + 1:]
+    if block.shape[1] == 0:
+        return [None] * len(rows)
 
-    return f"{main}.{frac}"
+    offset = block.argmax(axis=1)
+    found = block[np.arange(len(rows)), offset]
+    values = text[rows, start_col + 1 + offset]
+    return [v if ok else None for v, ok in zip(values, found)]
 
 
 def normalize_text_for_compare(s: str) -> str:
@@ -91,7 +96,11 @@ def normalize_text_for_compare(s: str) -> str:
     if pd.isna(s):
         return ""
 
-    s = str(s)
+    return _normalize_text(str(s))
+
+
+@lru_cache(maxsize=NORMALIZE_CACHE_SIZE)
+def _normalize_text(s: str) -> str:
     s = unicodedata.normalize("NFKD", s)
 
     # оставить только alnum (любой язык), выкинуть вообще все символы/пробелы/тире
@@ -101,13 +110,131 @@ def normalize_text_for_compare(s: str) -> str:
 
 
 
-def normalize_subclass_simple(code):
+def subclass_key(code):
     """
-    Нормализатор для сравнения (если Subclass уже в виде NNNN.NN или просто цифры).
+    Канонический ключ Subclass — целое NNNNNN (4321.02 → 432102); единственный нормализатор кода.
+
+    Первые 4 цифры — класс, следующие 2 (добитые нулями) — подкласс; длинный хвост
+    (артефакты float: 9000.149999999) округляется вверх: 9000.15 → 900015,
+    9999.995 → 1000000 (перенос в класс). None, если цифр < 5.
     """
-    if pd.isna(code):
+    if code is None or pd.isna(code):
         return None
-    s = re.sub(r"[^0-9]", "", str(code))
-    if len(s) < 5:
+    digits = _RE_NON_DIGIT.sub("", str(code))
+    if len(digits) < 5:
+        return None  # слишком коротко, это не Subclass
+    return int(digits[:4]) * 100 + _subclass_frac(digits[4:])
+
+
+def _subclass_frac(frac_raw: str) -> int:
+    """Две цифры подкласса; длинный хвост — вверх до сотых (100 = перенос в класс)."""
+    if len(frac_raw) <= 2:
+        return int(frac_raw.ljust(2, "0"))
+    scale = 10 ** (len(frac_raw) - 2)
+    return -(-int(frac_raw) // scale)
+
+
+def format_subclass_key(key):
+    """Ключ Subclass → строка NNNN.NN (для показа и выгрузки)."""
+    if key is None or pd.isna(key):
         return None
-    return f"{s[:4]}.{s[4:].ljust(2, '0')[:2]}"
+    key = int(key)
+    return f"{key // 100:04d}.{key % 100:02d}"
+
+
+def normalize_subclass_simple(code):
+    """Код Subclass в любом виде (NNNN.NN, цифры, float с хвостом) → строка NNNN.NN."""
+    return format_subclass_key(subclass_key(code))
+
+
+# ================== BATCHED (Series) ВЕРСИИ ==================
+# Те же нормализаторы для целой колонки: принимают pd.Series / np.ndarray,
+# возвращают pd.Series (None там, где скалярная версия вернула бы None).
+
+_RE_ARABIC_SPLIT = re.compile(r"^((?s:.*?))([؀-ۿ].*)")
+
+
+def _as_series(values) -> pd.Series:
+    if isinstance(values, pd.Series):
+        return values
+    return pd.Series(np.asarray(values, dtype=object), dtype=object)
+
+
+def _none_where_missing(s: pd.Series) -> pd.Series:
+    return s.astype(object).where(s.notna(), None)
+
+
+def split_en_ar_series(values) -> pd.DataFrame:
+    """Батч-версия split_en_ar: DataFrame с колонками en, ar."""
+    col = _as_series(values)
+    empty = col.map(lambda v: not v, na_action=None).astype(bool)
+    s = col.astype(str).str.strip()
+
+    parts = s.str.extract(_RE_ARABIC_SPLIT)
+    matched = parts[1].notna()
+
+    en = parts[0].str.strip().where(matched, s)
+    ar = parts[1].str.strip()
+    en = en.where((en != "") & ~empty)
+    ar = ar.where((ar != "") & ~empty)
+
+    return pd.DataFrame({"en": _none_where_missing(en), "ar": _none_where_missing(ar)}, index=col.index)
+
+
+def extract_digits_series(values) -> pd.Series:
+    """Батч-версия extract_digits."""
+    col = _as_series(values)
+    digits = col.astype(str).str.replace(_RE_NON_DIGIT, "", regex=True)
+    return _none_where_missing(digits.where(col.notna() & (digits != "")))
+
+
+def subclass_key_series(values) -> pd.Series:
+    """Батч-версия subclass_key: nullable Int32 (<NA>, если это не код)."""
+    col = _as_series(values)
+    digits = extract_digits_series(col)
+    digits = digits[digits.str.len() >= 5]
+
+    frac_raw = digits.str[4:]
+    frac = frac_raw.str.ljust(2, "0").where(frac_raw.str.len() <= 2)
+    # длинный хвост — та же формула, что в скалярной версии (их немного)
+    long_frac = frac_raw[frac.isna()]
+    if len(long_frac):
+        frac.loc[long_frac.index] = long_frac.map(_subclass_frac)
+
+    key = digits.str[:4].astype("int64") * 100 + frac.astype("int64")
+    return key.reindex(col.index).astype("Int32")
+
+
+def format_subclass_key_series(keys) -> pd.Series:
+    """Батч-версия format_subclass_key."""
+    keys = _as_series(keys)
+    valid = keys.notna()
+    k = keys[valid].astype("int64")
+    text = (k // 100).astype(str).str.zfill(4) + "." + (k % 100).astype(str).str.zfill(2)
+    return _none_where_missing(text.reindex(keys.index))
+
+
+def normalize_subclass_simple_series(values) -> pd.Series:
+    """Батч-версия normalize_subclass_simple."""
+    return format_subclass_key_series(subclass_key_series(values))
+
+
+def normalize_text_for_compare_series(values) -> pd.Series:
+    """
+    Батч-версия normalize_text_for_compare: NFKD, только буквы/цифры, lower; NaN → "".
+    Нормализуется каждое различное значение один раз (factorize → уникальные → обратно по кодам).
+    """
+    col = _as_series(values)
+    codes, uniques = pd.factorize(col.astype(str).where(col.notna()))
+
+    # код -1 (NaN) попадает на последний элемент — ""
+    normalized = np.array([_normalize_text(u) for u in uniques] + [""], dtype=object)
+    return pd.Series(normalized[codes], index=col.index, name=col.name, dtype=object)
+
+
+def text_fingerprints(values) -> np.ndarray:
+    """
+    uint64-отпечатки нормализованного текста (normalize_text_for_compare_series → hash_array).
+    Равный нормализованный текст → равный отпечаток; обратное — с точностью до коллизии 64-битного хеша.
+    """
+    return pd.util.hash_array(normalize_text_for_compare_series(values).to_numpy())
@@ -0,0 +1,397 @@
+import hashlib
+import importlib.util
+import io
+import os
+import posixpath
+import re
+import threading
+import zipfile
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from openpyxl import load_workbook
+from openpyxl.cell.cell import ERROR_CODES
+from xml.etree import ElementTree
+
+# Сколько загруженных книг держим в памяти одновременно (старый + новый файл + запас)
+MAX_SESSIONS = 4
+
+# Движки чтения:
+#   openpyxl — по умолчанию, всегда доступен
+#   calamine — быстрый ридер на Rust (pip install python-calamine)
+#   csv      — заранее выгруженные листы рядом с файлом:
+#              <файл>.csv для первого листа, <файл>/<лист>.csv для остальных
+ENGINES = ("openpyxl", "calamine", "csv")
+READER_ENGINE = os.environ.get("SHAMS_READER_ENGINE", "openpyxl")
+
+
+# Строки, которые pandas.read_excel по умолчанию превращает в NaN
+_NA_STRINGS = {
+    "", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan",
+    "1.#IND", "1.#QNAN", "<NA>", "N/A", "NA", "NULL", "NaN", "None", "n/a", "nan", "null",
+}
+
+
+def workbook_key(file_bytes: bytes) -> str:
+    """Ключ загрузки: SHA-256 от байтов файла."""
+    return hashlib.sha256(file_bytes).hexdigest()
+
+
+_NS_MAIN = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+_NS_REL = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}"
+_NS_PKG_REL = "{http://schemas.openxmlformats.org/package/2006/relationships}"
+
+# элемент sharedStrings (<si>...</si> или пустой <si/>) и ячейка-ссылка на него
+_SST_ITEM = re.compile(rb"<si\b[^>]*?(?:/>|>(.*?)</si>)", re.S)
+_SST_CELL = re.compile(rb'(<c\b[^>]*?\bt="s"[^>]*>\s*<v>)(\d+)(</v>)')
+
+
+# Отпечатки листов последних книг: workbook_key → {лист: отпечаток}
+# (ключ — SHA-256, а не сами байты: кэш не держит загруженные файлы в памяти)
+_fingerprints = OrderedDict()
+_fingerprints_lock = threading.Lock()
+
+
+def sheet_fingerprints(file_bytes: bytes, key: str | None = None) -> dict:
+    """
+    Отпечатки содержимого листов xlsx: {имя листа: SHA-256}.
+    Кэшируются по workbook_key (LRU на MAX_SESSIONS книг); key — уже посчитанный
+    workbook_key(file_bytes), чтобы не хешировать файл повторно.
+
+    Хешируется XML листа, в котором индексы sharedStrings заменены самими строками,
+    плюс styles.xml и флаг date1904 — то есть всё, от чего зависят прочитанные значения.
+    Лист с тем же отпечатком в другом файле читается в те же значения.
+    Не xlsx / битый архив → {} (сравнивать не с чем). Результат общий — не менять.
+    """
+    key = key or workbook_key(file_bytes)
+
+    with _fingerprints_lock:
+        result = _fingerprints.get(key)
+        if result is not None:
+            _fingerprints.move_to_end(key)
+            return result
+
+    result = _compute_fingerprints(file_bytes)
+
+    with _fingerprints_lock:
+        result = _fingerprints.setdefault(key, result)
+        _fingerprints.move_to_end(key)
+        while len(_fingerprints) > MAX_SESSIONS:
+            _fingerprints.popitem(last=False)
+
+    return result
+
+
+def _compute_fingerprints(file_bytes: bytes) -> dict:
+    try:
+        with zipfile.ZipFile(io.BytesIO(file_bytes)) as zf:
+            names = set(zf.namelist())
+            workbook, rels = _workbook_parts(zf)
+
+            targets = {rel_id: target for rel_id, (target, _) in rels.items()}
+            sst_path = next((target for target, kind in rels.values() if kind.endswith("/sharedStrings")), None)
+
+            sst_bytes = zf.read(sst_path) if sst_path in names else b""
+            sst = [m.group(1) or b"" for m in _SST_ITEM.finditer(sst_bytes)]
+
+            pr = workbook.find(f"{_NS_MAIN}workbookPr")
+            common = hashlib.sha256()
+            common.update(b"date1904=" + str(pr.get("date1904") if pr is not None else None).encode())
+            common.update(zf.read("xl/styles.xml") if "xl/styles.xml" in names else b"")
+
+            result = {}
+            for sheet in workbook.iter(f"{_NS_MAIN}sheet"):
+                path = targets.get(sheet.get(f"{_NS_REL}id"))
+                if path not in names:
+                    continue
+                h = common.copy()
+                h.update(_resolve_shared_strings(zf.read(path), sst, sst_bytes))
+                result[sheet.get("name")] = h.hexdigest()
+    except (zipfile.BadZipFile, KeyError, ElementTree.ParseError):
+        return {}
+
+    return result
+
+
+def sheet_names(file_bytes: bytes) -> list:
+    """
+    Имена рабочих листов в порядке книги — из xl/workbook.xml, без декодирования листов.
+    Не xlsx / битый архив → имена из open_workbook (как у pd.ExcelFile).
+    """
+    try:
+        with zipfile.ZipFile(io.BytesIO(file_bytes)) as zf:
+            workbook, rels = _workbook_parts(zf)
+    except (zipfile.BadZipFile, KeyError, ElementTree.ParseError):
+        return open_workbook(file_bytes).sheet_names
+
+    return [
+        sheet.get("name")
+        for sheet in workbook.iter(f"{_NS_MAIN}sheet")
+        if rels.get(sheet.get(f"{_NS_REL}id"), ("", ""))[1].endswith("/worksheet")
+    ]
+
+
+def _workbook_parts(zf: zipfile.ZipFile) -> tuple:
+    """(корень xl/workbook.xml, {rId: (путь части в архиве, тип связи)})."""
+    workbook = ElementTree.fromstring(zf.read("xl/workbook.xml"))
+    rels = ElementTree.fromstring(zf.read("xl/_rels/workbook.xml.rels"))
+
+    parts = {}
+    for rel in rels.iter(f"{_NS_PKG_REL}Relationship"):
+        target = rel.get("Target", "")
+        target = target.lstrip("/") if target.startswith("/") else posixpath.normpath(posixpath.join("xl", target))
+        parts[rel.get("Id")] = (target, rel.get("Type", ""))
+    return workbook, parts
+
+
+def _resolve_shared_strings(xml: bytes, sst: list, sst_bytes: bytes) -> bytes:
+    """XML листа с подставленными строками вместо индексов sharedStrings."""
+    try:
+        resolved, n = _SST_CELL.subn(lambda m: m.group(1) + b"\0" + sst[int(m.group(2))] + b"\0" + m.group(3), xml)
+    except IndexError:
+        n = -1
+    if n != xml.count(b't="s"'):
+        # нестандартная разметка (префиксы пространств имён и т.п.) — берём весь sharedStrings
+        return xml + b"\0" + sst_bytes
+    return resolved
+
+
+def engine_available(engine: str) -> bool:
+    if engine == "calamine":
+        return importlib.util.find_spec("python_calamine") is not None
+    return engine in ENGINES
+
+
+def engine_chain(engine: str | None = None, fallback: bool = True) -> list:
+    """Выбранный движок (или READER_ENGINE) + openpyxl как запасной."""
+    first = engine or READER_ENGINE
+    if first not in ENGINES:
+        raise ValueError(f"Неизвестный движок чтения: {first} (доступны: {', '.join(ENGINES)})")
+    chain = [first] if first == "openpyxl" or not fallback else [first, "openpyxl"]
+    return [e for e in chain if engine_available(e)]
+
+
+def _as_source(source):
+    return io.BytesIO(source) if isinstance(source, (bytes, bytearray)) else source
+
+
+def _csv_path(source, sheet) -> Path:
+    if isinstance(source, (bytes, bytearray)):
+        raise FileNotFoundError("CSV-движок читает только выгрузки рядом с файлом на диске")
+    base = Path(source)
+    path = base.with_suffix(".csv") if sheet in (0, None) else base.with_suffix("") / f"{sheet}.csv"
+    if not path.exists():
+        raise FileNotFoundError(f"Нет CSV-выгрузки листа: {path}")
+    return path
+
+
+def _read_excel(engine):
+    def read(source, sheet, header):
+        return pd.read_excel(_as_source(source), sheet_name=sheet, header=header, engine=engine)
+    return read
+
+
+def _read_csv(source, sheet, header):
+    return pd.read_csv(_csv_path(source, sheet), header=header)
+
+
+_READERS = {
+    "openpyxl": _read_excel("openpyxl"),
+    "calamine": _read_excel("calamine"),
+    "csv": _read_csv,
+}
+
+
+def read_sheet(source, sheet=0, header=None, engine: str | None = None, fallback: bool = True) -> pd.DataFrame:
+    """
+    Читает один лист (source — байты или путь) первым сработавшим движком
+    из engine_chain(engine). Ошибка поднимается, только если не сработал ни один.
+    """
+    error = None
+    for eng in engine_chain(engine, fallback):
+        try:
+            return _READERS[eng](source, sheet, header)
+        except Exception as e:  # движок не справился — пробуем следующий
+            error = e
+    raise error or _no_engine(engine)
+
+
+def _no_engine(engine) -> ValueError:
+    """Ошибка для пустой цепочки: ни один движок не пробовался (нет установленных / только CSV)."""
+    return ValueError(f"Нет доступного движка чтения Excel для «{engine or READER_ENGINE}»")
+
+
+def iter_sheet_rows(file_bytes: bytes, sheets=None, engine: str | None = None):
+    """
+    Построчное чтение листов: генератор пар (лист, итератор строк-кортежей).
+    Значения — сырые значения движка; приводить через cell_value.
+    """
+    wb, error = None, None
+    for eng in engine_chain(engine):
+        if eng == "csv":
+            continue  # построчного чтения CSV нет
+        try:
+            wb = _open_rows(file_bytes, eng)
+            break
+        except Exception as e:  # движок не справился — пробуем следующий
+            error = e
+    if wb is None:
+        raise error or _no_engine(engine)
+
+    try:
+        for sheet in (sheets if sheets is not None else wb.sheet_names):
+            yield sheet, wb.rows(sheet)
+    finally:
+        wb.close()
+
+
+class _OpenpyxlRows:
+    def __init__(self, file_bytes):
+        self._wb = open_readonly(file_bytes)
+        self.sheet_names = self._wb.sheetnames
+
+    def rows(self, sheet):
+        return worksheet(self._wb, sheet).iter_rows(values_only=True)
+
+    def close(self):
+        self._wb.close()
+
+
+class _CalamineRows:
+    def __init__(self, file_bytes):
+        from python_calamine import CalamineWorkbook
+
+        self._wb = CalamineWorkbook.from_filelike(io.BytesIO(file_bytes))
+        self.sheet_names = list(self._wb.sheet_names)
+
+    def rows(self, sheet):
+        if isinstance(sheet, int):
+            return self._wb.get_sheet_by_index(sheet).iter_rows()
+        return self._wb.get_sheet_by_name(sheet).iter_rows()
+
+    def close(self):
+        pass
+
+
+def _open_rows(file_bytes, engine):
+    return _CalamineRows(file_bytes) if engine == "calamine" else _OpenpyxlRows(file_bytes)
+
+
+def open_readonly(file_bytes: bytes):
+    """openpyxl-книга в режиме read_only (построчное чтение без сетки в памяти)."""
+    return load_workbook(io.BytesIO(file_bytes), read_only=True, data_only=True)
+
+
+def worksheet(wb, sheet):
+    """Лист openpyxl по имени или по номеру (как sheet_name в pd.read_excel)."""
+    return wb.worksheets[sheet] if isinstance(sheet, int) else wb[sheet]
+
+
+def cell_value(v):
+    """Значение ячейки openpyxl → как его отдал бы pd.read_excel(header=None)."""
+    if v is None:
+        return np.nan
+    if isinstance(v, float) and v.is_integer():
+        return int(v)
+    if isinstance(v, str) and (v in _NA_STRINGS or v in ERROR_CODES):
+        return np.nan
+    return v
+
+
+class WorkbookSession:
+    """
+    Один загруженный Excel-файл.
+
+    Каждый лист декодируется не более одного раза (движком из engine_chain)
+    и хранится как "сырой" DataFrame (header=None). Сессию разделяют header_log
+    и shams_parser, поэтому возвращаемые кадры нельзя менять на месте.
+    """
+
+    def __init__(self, file_bytes: bytes, key: str | None = None, engine: str | None = None):
+        self.key = key or workbook_key(file_bytes)
+        self._bytes = file_bytes
+        self.engine, self._xls = self._open(engine)
+        self.sheet_names = list(self._xls.sheet_names)
+        self._frames = {}
+        self._heads = {}  # лист -> (сколько строк запрошено, кадр)
+        self._lock = threading.Lock()
+
+    def _open(self, engine):
+        error = None
+        for eng in engine_chain(engine):
+            if eng == "csv":
+                continue
+            try:
+                return eng, pd.ExcelFile(io.BytesIO(self._bytes), engine=eng)
+            except Exception as e:
+                error = e
+        raise error or _no_engine(engine)
+
+    def sheet(self, name) -> pd.DataFrame:
+        """Сырой лист (header=None); декодируется только при первом обращении."""
+        with self._lock:
+            df = self._frames.get(name)
+            if df is None:
+                try:
+                    df = pd.read_excel(self._xls, sheet_name=name, header=None)
+                except Exception:
+                    if self.engine == "openpyxl":
+                        raise
+                    df = read_sheet(self._bytes, name, header=None, engine="openpyxl")
+                self._frames[name] = df
+                self._heads.pop(name, None)
+        return df
+
+    def head(self, name, nrows: int) -> pd.DataFrame:
+        """
+        Первые nrows строк листа (header=None) без декодирования остального листа.
+        Лист уже прочитан целиком — срез из него; иначе читается через тот же ExcelFile.
+        """
+        with self._lock:
+            df = self._frames.get(name)
+            if df is not None:
+                return df.iloc[:nrows]
+
+            read, df = self._heads.get(name, (0, None))
+            # прочитанного хватает или лист короче, чем просили в прошлый раз
+            if df is not None and (read >= nrows or len(df) < read):
+                return df.iloc[:nrows]
+
+            try:
+                df = pd.read_excel(self._xls, sheet_name=name, header=None, nrows=nrows)
+            except Exception:
+                if self.engine == "openpyxl":
+                    raise
+                df = pd.read_excel(io.BytesIO(self._bytes), sheet_name=name, header=None, nrows=nrows, engine="openpyxl")
+            self._heads[name] = (nrows, df)
+        return df
+
+
+_sessions = OrderedDict()
+_sessions_lock = threading.Lock()
+
+
+def open_workbook(file_bytes: bytes) -> WorkbookSession:
+    """
+    Возвращает сессию для загрузки, создавая её при первом обращении.
+    Одинаковые байты → одна и та же сессия (LRU на MAX_SESSIONS книг).
+    """
+    key = workbook_key(file_bytes)
+
+    with _sessions_lock:
+        session = _sessions.get(key)
+        if session is not None:
+            _sessions.move_to_end(key)
+            return session
+
+    session = WorkbookSession(file_bytes, key)
+
+    with _sessions_lock:
+        session = _sessions.setdefault(key, session)
+        _sessions.move_to_end(key)
+        while len(_sessions) > MAX_SESSIONS:
+            _sessions.popitem(last=False)
+
+    return session